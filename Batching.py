@@ -0,0 +1,68 @@
+import asyncio
+
+
+class MicroBatcher:
+    def __init__(self,function_system,max_batch_size=256,max_delay=0.001,targets=None,max_depth=None,max_calculations=None):
+        r'''
+        MicroBatcher coalesces concurrent asyncio requests for single records into one vectorized evaluation, see
+        FunctionSystem.evaluate. A batch is evaluated once max_batch_size records are pending, or max_delay seconds
+        after its first record arrived. Records with different variables are evaluated in separate batches.
+
+        The evaluation runs in the event loop, hence it should only be used for function systems of which a batch
+        evaluates in well below a millisecond per record.
+
+        :param function_system: FunctionSystem to evaluate.
+        :param max_batch_size: Maximum number of records per evaluation.
+        :param max_delay: Maximum number of seconds a record waits for other records.
+        :param targets: Iterable of variable names, see FunctionSystem.compile.
+        :param max_depth: Maximum number of function relations chained in a single calculation, see FunctionSystem.compile.
+        :param max_calculations: Maximum number of calculations the search derives, see FunctionSystem.compile.
+        '''
+        self.function_system = function_system
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.plan_options = dict(targets=targets,max_depth=max_depth,max_calculations=max_calculations)
+        self.pending = {}
+        self.timers = {}
+    async def evaluate(self,record):
+        r'''
+        Evaluates a single record as part of a batch.
+
+        :param record: Dict of variable name to scalar.
+        :return: Dict of label to result, see FunctionSystem.evaluate.
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch_key = frozenset(record)
+        batch = self.pending.setdefault(batch_key,[])
+        batch.append((record, future))
+        if len(batch) >= self.max_batch_size:
+            self.flush(batch_key)
+        elif batch_key not in self.timers:
+            self.timers[batch_key] = loop.call_later(self.max_delay,self.flush,batch_key)
+        return(await future)
+    def flush(self,batch_key=None):
+        r'''
+        Evaluates the pending records immediately.
+
+        :param batch_key: Frozenset of the variables of the batch to evaluate, None to evaluate all pending batches.
+        :return:
+        '''
+        batch_keys = list(self.pending) if batch_key is None else [batch_key]
+        for batch_key in batch_keys:
+            timer = self.timers.pop(batch_key,None)
+            if timer is not None:
+                timer.cancel()
+            batch = self.pending.pop(batch_key,[])
+            if not batch:
+                continue
+            try:
+                results = self.function_system.evaluate([ record for (record, _) in batch ],**self.plan_options)
+            except Exception as e:
+                for (_, future) in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for ((_, future), result) in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -1,40 +1,169 @@
-class HypotheticalCalculation:
-    def __init__(self,col_name,function_relation=None, symbolic_history=None):
-        if symbolic_history is None:
-            self.symbolic_history = frozenset()
-        else:
-            self.symbolic_history = symbolic_history
+from collections import OrderedDict
+
+import pandas as pd
+
+
+class CalculationNode:
+    __slots__ = ('col_name', 'function_relation', 'input_nodes', 'node_id', 'depth', 'relation_mask', 'consumed_function_relations')
+
+    def __init__(self,col_name,function_relation=None,input_nodes=None,node_id=None,relation_bit=0):
+        r'''
+        CalculationNode is the hash-consed symbolic identity of a calculation. A node is determined by its output
+        variable name, the function relation used and the nodes of its inputs. Nodes are shared between all calculations
+        which use them as input, such that equality and hashing are by identity and cost O(1) per node.
+
+        :param col_name: variable name of the calculation result.
+        :param function_relation: PartialFunctionRelation used to perform the calculation.
+        :param input_nodes: Iterable of CalculationNodes used as input for the calculation.
+        :param node_id: Integer id of the node within its CalculationGraph, None for standalone nodes.
+        :param relation_bit: Integer bit of function_relation within its FunctionSystem, 0 for standalone nodes.
+        '''
+        if input_nodes is None:
+            input_nodes = frozenset()
         self.col_name = col_name
         self.function_relation = function_relation
+        self.input_nodes = frozenset(input_nodes)
+        self.node_id = node_id
+        self.depth = max( (node.depth+1 for node in self.input_nodes), default=0 )
+        self.consumed_function_relations = None
+        self.get_relation_mask(relation_bit)
     def __str__(self):
         r'''
-        Returns a human-readable format of the calculation.
+        Returns a human-readable format of the node.
 
         :return:
         '''
-        out = tuple( str(symb_part) for symb_part in self.symbolic_representation() )
+        out = tuple( str(symb_part) for symb_part in self.expanded_representation() )
         out = str(out)
         return(out)
 
-    def symbolic_representation(self):
+    def key(self):
         r'''
-        Generates the symbolic representation of the calculation.
+        Returns the key under which the node is interned in a CalculationGraph.
+
+        :return:
+        '''
+        return((self.col_name, self.function_relation, self.input_nodes))
+
+    @property
+    def historic_function_relations(self):
+        return(self.get_consumed_function_relations())
+
+    def get_consumed_function_relations(self):
+        r'''
+        Collects the consumed function relations in the provenance of the node. The search uses relation_mask instead,
+        hence the set is only built on first access, from the cached sets of the input nodes, and then kept on the node.
+
+        :return:
+        '''
+        if self.consumed_function_relations is None:
+            consumed_function_relations = set()
+            if self.function_relation is not None:
+                consumed_function_relations.add(self.function_relation)
+            for node in self.input_nodes:
+                consumed_function_relations.update(node.get_consumed_function_relations())
+            self.consumed_function_relations = frozenset(consumed_function_relations)
+        return(self.consumed_function_relations)
+
+    def get_relation_mask(self,relation_bit=0):
+        r'''
+        Collects the integer bitmask of the function relations consumed in the provenance of the node. Two nodes share
+        a function relation if and only if the bitwise and of their masks is non-zero.
+
+        :param relation_bit: Integer bit of the function relation of the node.
+        :return:
+        '''
+        try:
+            out = self.relation_mask
+        except AttributeError:
+            relation_mask = relation_bit
+            for node in self.input_nodes:
+                relation_mask |= node.relation_mask
+            self.relation_mask = relation_mask
+            out = self.relation_mask
+        return(out)
+
+    def expanded_representation(self):
+        r'''
+        Expands the full provenance of the node into nested (col_name, function_relation, symbolic_history) tuples. The
+        cost is proportional to the size of the provenance tree, hence this is only meant for display purposes.
 
         :return:
         '''
-        return((self.col_name, self.function_relation, self.symbolic_history))
+        symbolic_history = frozenset( node.expanded_representation() for node in self.input_nodes )
+        return((self.col_name, self.function_relation, symbolic_history))
+
+
+class CalculationGraph:
+    def __init__(self,relation_bits=None):
+        r'''
+        CalculationGraph interns CalculationNodes. Every distinct (col_name, function_relation, input_nodes) triple is
+        represented by exactly one shared node with a small integer id, assigned in order of creation.
+
+        :param relation_bits: Dict-like of function relation to its integer bit, used for the relation masks of nodes.
+        '''
+        if relation_bits is None:
+            relation_bits = dict()
+        self.nodes = []
+        self.index = {}
+        self.relation_bits = relation_bits
+    def __len__(self):
+        return(len(self.nodes))
+    def __iter__(self):
+        return(iter(self.nodes))
+    def __contains__(self,key):
+        r'''
+        Determines if a node with the given key, see CalculationNode.key, has been interned.
+
+        :param key: Tuple of (col_name, function_relation, input_nodes).
+        :return:
+        '''
+        return(key in self.index)
+    def get(self,key):
+        r'''
+        Returns the interned node for key, or None if it does not exist.
+
+        :param key: Tuple of (col_name, function_relation, input_nodes).
+        :return:
+        '''
+        return(self.index.get(key))
+    def intern(self,col_name,function_relation=None,input_nodes=None):
+        r'''
+        Returns the unique node for the given triple, creating it if it does not exist yet.
+
+        :param col_name: variable name of the calculation result.
+        :param function_relation: PartialFunctionRelation used to perform the calculation.
+        :param input_nodes: Iterable of CalculationNodes used as input for the calculation.
+        :return: CalculationNode
+        '''
+        if input_nodes is None:
+            input_nodes = frozenset()
+        key = (col_name, function_relation, frozenset(input_nodes))
+        node = self.index.get(key)
+        if node is None:
+            relation_bit = self.relation_bits.get(function_relation,0)
+            node = CalculationNode(col_name, function_relation, key[2], node_id=len(self.nodes), relation_bit=relation_bit)
+            self.nodes.append(node)
+            self.index[key] = node
+        return(node)
 
 
 class Calculation:
-    def __init__(self, col_name, col_df, function_relation=None, history=None):
+    __slots__ = ('col_name', '_col_df', 'function_relation', 'history', 'node')
+
+    def __init__(self, col_name, col_df, function_relation=None, history=None, node=None):
         r'''
         Calculation is a class that supports storing calculation details such as variable name, input data,
         source function, calculation history and previously used function relations.
 
+        The symbolic history, consumed function relations and relation mask are not copied per calculation, but are
+        read from the shared CalculationNode.
+
         :param col_name: variable name of the calculation result.
         :param col_df: pandas Series or DataFrame of the calculation result.
         :param function_relation: PartialFunctionRelation used to perform the calculation.
         :param history: record of the previous calculation results used to perform the calculation.
+        :param node: CalculationNode representing the calculation, created from the history if not provided.
         '''
         if history is None:
             self.history = frozenset()
@@ -43,6 +172,7 @@ class Calculation:
         self.col_name = col_name
         self.col_df = col_df
         self.function_relation = function_relation
+        self.node = node
         self.process()
 
     def __str__(self):
@@ -51,9 +181,7 @@ class Calculation:
 
         :return:
         '''
-        out = tuple( str(symb_part) for symb_part in self.symbolic_representation() )
-        out = str(out)
-        return(out)
+        return(str(self.node))
 
     def symbolic_representation(self):
         r'''
@@ -61,7 +189,7 @@ class Calculation:
 
         :return:
         '''
-        return((self.col_name, self.function_relation, self.symbolic_history))
+        return(self.node.key())
 
     def process(self):
         r'''
@@ -69,38 +197,142 @@ class Calculation:
 
         :return:
         '''
-        self.get_consumed_function_relations()
-        self.get_symbolic_history()
+        if self.node is None:
+            input_nodes = ( calc.node for calc in self.history )
+            self.node = CalculationNode(self.col_name, self.function_relation, input_nodes)
+
+    @property
+    def col_df(self):
+        return(self._col_df)
+
+    @col_df.setter
+    def col_df(self,col_df):
+        self._col_df = col_df
+
+    @property
+    def historic_function_relations(self):
+        return(self.get_consumed_function_relations())
+
+    @property
+    def symbolic_history(self):
+        return(self.get_symbolic_history())
+
+    @property
+    def relation_mask(self):
+        return(self.node.relation_mask)
 
     def get_consumed_function_relations(self):
         r'''
-        Collects the consumed function relations in the calculation history for quick reference.
+        Collects the consumed function relations in the calculation history.
 
         :return:
         '''
-        try:
-            out = self.historic_function_relations
-        except AttributeError:
-            consumed_function_relations = set()
-            if self.function_relation is not None:
-                consumed_function_relations.add(self.function_relation)
-            for calc in self.history:
-                consumed_function_relations.update(calc.historic_function_relations)
-            self.historic_function_relations = frozenset(consumed_function_relations)
-            out = self.historic_function_relations
-        return(out)
+        return(self.node.get_consumed_function_relations())
     def get_symbolic_history(self):
         r'''
-        Collects the symbolic history of the calculation.
+        Collects the symbolic history of the calculation, i.e. the shared CalculationNodes of the input calculations.
 
         :return:
         '''
-        try:
-            out = self.symbolic_history
-        except AttributeError:
-            symbolic_history = set()
-            for historic_calculation in self.history:
-                symbolic_history.add(historic_calculation.symbolic_representation())
-            self.symbolic_history = frozenset(symbolic_history)
-            out = self.symbolic_history
-        return(out)
+        return(self.node.input_nodes)
+
+
+class ResultCache:
+    def __init__(self,maxsize=None):
+        r'''
+        ResultCache is a least recently used cache of the results of LazyCalculations. Once more than maxsize results
+        are cached, the least recently used result is evicted and will be recomputed when it is accessed again.
+
+        :param maxsize: Maximum number of cached results, None for no limit.
+        '''
+        self.maxsize = maxsize
+        self.results = OrderedDict()
+    def __len__(self):
+        return(len(self.results))
+    def get(self,calculation):
+        r'''
+        Returns the cached result of calculation, or None if it is not cached.
+
+        :param calculation: LazyCalculation
+        :return:
+        '''
+        result = self.results.get(calculation)
+        if result is not None:
+            self.results.move_to_end(calculation)
+        return(result)
+    def put(self,calculation,result):
+        r'''
+        Caches the result of calculation, evicting the least recently used result if the cache is full.
+
+        :param calculation: LazyCalculation
+        :param result: pandas Series.
+        :return:
+        '''
+        self.results[calculation] = result
+        self.results.move_to_end(calculation)
+        if self.maxsize is not None and len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+
+
+class LazyCalculation(Calculation):
+    __slots__ = ('result_cache', 'dtype')
+
+    def __init__(self, col_name, function_relation, history, node=None, result_cache=None, dtype=None):
+        r'''
+        LazyCalculation is a Calculation of which the result is only computed when col_df is first accessed. Without a
+        result_cache the result is memoized on the calculation itself, with a result_cache it is kept in the cache and
+        recomputed from the history if it has been evicted.
+
+        :param col_name: variable name of the calculation result.
+        :param function_relation: PartialFunctionRelation used to perform the calculation.
+        :param history: record of the previous calculations used to perform the calculation.
+        :param node: CalculationNode representing the calculation, created from the history if not provided.
+        :param result_cache: ResultCache shared between lazy calculations, None to memoize on the calculation.
+        :param dtype: numpy dtype to keep the result in, None to keep the dtype returned by the function relation.
+        '''
+        self.result_cache = result_cache
+        self.dtype = dtype
+        super(LazyCalculation,self).__init__(col_name, None, function_relation=function_relation, history=frozenset(history), node=node)
+
+    @property
+    def col_df(self):
+        r'''
+        Returns the result of the calculation, computing it on first access.
+
+        :return:
+        '''
+        if self.result_cache is None:
+            if self._col_df is None:
+                self._col_df = self.compute()
+            return(self._col_df)
+        col_df = self.result_cache.get(self)
+        if col_df is None:
+            col_df = self.compute()
+            self.result_cache.put(self,col_df)
+        return(col_df)
+
+    @col_df.setter
+    def col_df(self,col_df):
+        self._col_df = col_df
+
+    def is_computed(self):
+        r'''
+        Determines if the result is currently available without computation.
+
+        :return:
+        '''
+        if self.result_cache is None:
+            return(self._col_df is not None)
+        return(self in self.result_cache.results)
+
+    def compute(self):
+        r'''
+        Computes the result of the calculation from the results of its input calculations.
+
+        :return: pandas Series.
+        '''
+        input_df = pd.concat([ calc.col_df for calc in self.history ],axis=1)
+        output = self.function_relation.compute_variable(input_df,self.col_name)
+        if self.dtype is not None:
+            output = output.astype(self.dtype,copy=False)
+        return(output)
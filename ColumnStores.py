@@ -0,0 +1,232 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from Calculations import Calculation
+
+
+class ColumnView:
+    def __init__(self,store,variable_ids):
+        r'''
+        ColumnView is a light-weight mapping of variable names to columns of a ColumnStore. Indexing with a variable
+        name returns a zero-copy numpy view of the column, indexing with a list of names returns a narrower ColumnView.
+        This allows functions written for pandas DataFrames, e.g. lambda df: df['a']*df['b'], to operate on the store.
+
+        :param store: ColumnStore holding the data.
+        :param variable_ids: Dict of variable name to node id within the store.
+        '''
+        self.store = store
+        self.variable_ids = variable_ids
+    def __getitem__(self,key):
+        if isinstance(key,(list,tuple,set,frozenset)):
+            return(ColumnView(self.store,{ variable:self.variable_ids[variable] for variable in key }))
+        return(self.store.column(self.variable_ids[key]))
+    def __contains__(self,key):
+        return(key in self.variable_ids)
+    def __iter__(self):
+        return(iter(self.variable_ids))
+    def __len__(self):
+        return(len(self.variable_ids))
+    @property
+    def columns(self):
+        return(list(self.variable_ids))
+    def to_dict(self):
+        r'''
+        Returns a dict of variable name to column view.
+
+        :return:
+        '''
+        return({ variable:self.store.column(node_id) for (variable, node_id) in self.variable_ids.items() })
+
+
+class ColumnStore:
+    def __init__(self,plan,index,dtype=np.float64,data=None):
+        r'''
+        ColumnStore keeps the results of all calculations of an ExecutionPlan as the columns of one preallocated 2-D
+        numpy array. The array is stored in column-major order, such that every column is a contiguous block of memory.
+
+        :param plan: ExecutionPlan whose results are stored.
+        :param index: pandas Index of the input rows.
+        :param dtype: numpy dtype of the stored results.
+        :param data: Existing 2-D array of shape (rows, nodes) to store the results in, e.g. in shared memory, instead of allocating one. Its dtype takes precedence over dtype.
+        '''
+        if data is None:
+            data = np.empty((len(index),len(plan)),dtype=dtype,order='F')
+        elif data.shape != (len(index),len(plan)):
+            msg = f'Expected data of shape {(len(index),len(plan))}, got {data.shape}'
+            raise ValueError(msg)
+        self.plan = plan
+        self.index = index
+        self.buffer = data
+        self.data = self.buffer
+    def __len__(self):
+        return(self.data.shape[1])
+    def column(self,node_id):
+        r'''
+        Returns a zero-copy view of the result of the node with node_id.
+
+        :param node_id: Integer node id.
+        :return: numpy.ndarray
+        '''
+        return(self.data[:,node_id])
+    def write(self,node_id,values):
+        r'''
+        Writes values as the result of the node with node_id.
+
+        :param node_id: Integer node id.
+        :param values: Array-like broadcastable to the column.
+        :return:
+        '''
+        self.data[:,node_id] = values
+    def append(self,other):
+        r'''
+        Appends the rows of another ColumnStore of the same plan. The capacity of the buffer is at least doubled when it
+        is exceeded, such that repeated appends cost amortized time proportional to the number of appended rows.
+
+        :param other: ColumnStore of the same plan.
+        :return:
+        '''
+        n_rows = self.data.shape[0]
+        n_total = n_rows + other.data.shape[0]
+        if n_total > self.buffer.shape[0]:
+            buffer = np.empty((max(n_total,2*self.buffer.shape[0]),len(self)),dtype=self.data.dtype,order='F')
+            buffer[:n_rows] = self.data
+            self.buffer = buffer
+        self.buffer[n_rows:n_total] = other.data
+        self.data = self.buffer[:n_total]
+        self.index = self.index.append(other.index)
+    def flush(self):
+        r'''
+        Writes pending changes of the results to their storage, a no-op for results kept in memory.
+
+        :return:
+        '''
+        pass
+    def view(self,variable_ids):
+        r'''
+        Returns a ColumnView on the store.
+
+        :param variable_ids: Dict of variable name to node id.
+        :return: ColumnView
+        '''
+        return(ColumnView(self,variable_ids))
+    def to_frame(self):
+        r'''
+        Exposes the results as a pandas DataFrame with a column per calculation, labelled as in ExecutionPlan.get_labels.
+
+        :return: pandas.DataFrame
+        '''
+        df = pd.DataFrame(self.data,index=self.index,columns=self.plan.get_labels(),copy=False)
+        return(df)
+    def get_series(self,node_id):
+        r'''
+        Exposes the result of the node with node_id as a pandas Series sharing memory with the store.
+
+        :param node_id: Integer node id.
+        :return: pandas.Series
+        '''
+        node = self.plan.get_nodes()[node_id]
+        series = pd.Series(self.column(node_id),index=self.index,name=node.col_name,copy=False)
+        return(series)
+    def get_calculations(self):
+        r'''
+        Exposes the results as a list of Calculations ordered by node id, see ExecutionPlan.execute.
+
+        :return:
+        '''
+        nodes = self.plan.get_nodes()
+        calculations = []
+        for node in nodes:
+            history = frozenset( calculations[input_node.node_id] for input_node in node.input_nodes )
+            calc = Calculation(node.col_name, self.get_series(node.node_id), function_relation=node.function_relation, history=history, node=node)
+            calculations.append(calc)
+        return(calculations)
+
+
+# File names within the directory of a MemmapColumnStore
+_RESULTS_FILE = 'results.npy'
+_INDEX_FILE = 'index.npy'
+_METADATA_FILE = 'metadata.json'
+
+class MemmapColumnStore(ColumnStore):
+    def __init__(self,plan,index,dtype=np.float64,directory=None):
+        r'''
+        MemmapColumnStore is a ColumnStore of which the array is a memory-mapped .npy file, such that runs with more
+        results than fit in memory can complete. The file is stored in column-major order, hence every calculation
+        result is one contiguous block of the file, and function relations receive memory-mapped views as inputs.
+        Only the pages in use are held in memory by the operating system.
+
+        The labels and index are stored next to the results, such that the results can be reopened without
+        recomputation, see open_results.
+
+        :param plan: ExecutionPlan whose results are stored.
+        :param index: pandas Index of the input rows. Object indexes must consist of strings, such that the index can be
+        stored without pickling.
+        :param dtype: numpy dtype of the stored results.
+        :param directory: Path of the scratch directory, created if it does not exist. Defaults to a new temporary directory.
+        :raises TypeError: If index is an object index with values other than strings.
+        '''
+        index_values = None
+        if not isinstance(index,pd.RangeIndex):
+            index_values = index.to_numpy()
+            if index_values.dtype == object:
+                if not all( isinstance(value,str) for value in index_values ):
+                    msg = 'The index of a MemmapColumnStore must be a RangeIndex, numeric, datetime or consist of strings, got an object index with other values.'
+                    raise TypeError(msg)
+                index_values = index_values.astype(str)
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='function-system-')
+        os.makedirs(directory,exist_ok=True)
+        data = np.lib.format.open_memmap(os.path.join(directory,_RESULTS_FILE),mode='w+',dtype=dtype,shape=(len(index),len(plan)),fortran_order=True)
+        super(MemmapColumnStore,self).__init__(plan,index,data=data)
+        self.directory = directory
+
+        metadata = {
+            'labels': plan.get_labels(),
+            'col_names': [ node.col_name for node in plan.get_nodes() ],
+            'columns': list(plan.columns),
+        }
+        if index_values is None:
+            metadata['range_index'] = [index.start, index.stop, index.step]
+        else:
+            np.save(os.path.join(directory,_INDEX_FILE),index_values,allow_pickle=False)
+        with open(os.path.join(directory,_METADATA_FILE),'w') as metadata_file:
+            json.dump(metadata,metadata_file)
+    def append(self,other):
+        r'''
+        Rows can not be appended, as the size of the file is fixed when the store is created.
+
+        :param other: ColumnStore of the same plan.
+        :raises TypeError: Always.
+        '''
+        msg = 'Rows can not be appended to a MemmapColumnStore, the size of its file is fixed. Append to an in-memory ColumnStore instead.'
+        raise TypeError(msg)
+    def flush(self):
+        r'''
+        Writes the modified pages of the results to the file.
+
+        :return:
+        '''
+        self.data.flush()
+
+def open_results(directory,mode='r'):
+    r'''
+    Reopens the results of a MemmapColumnStore without recomputation. The columns are memory-mapped, hence they are only
+    read from disk when they are accessed.
+
+    :param directory: Path of the directory of the MemmapColumnStore.
+    :param mode: numpy.memmap mode, 'r' for read-only or 'r+' to allow modification of the stored results.
+    :return: pandas.DataFrame with a column per calculation, labelled as in ExecutionPlan.get_labels.
+    '''
+    with open(os.path.join(directory,_METADATA_FILE),'r') as metadata_file:
+        metadata = json.load(metadata_file)
+    if 'range_index' in metadata:
+        index = pd.RangeIndex(*metadata['range_index'])
+    else:
+        index = pd.Index(np.load(os.path.join(directory,_INDEX_FILE),allow_pickle=False))
+    data = np.load(os.path.join(directory,_RESULTS_FILE),mmap_mode=mode)
+    df = pd.DataFrame(data,index=index,columns=metadata['labels'],copy=False)
+    return(df)
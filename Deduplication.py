@@ -0,0 +1,84 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+def fingerprint(values):
+    r'''
+    Computes a content fingerprint of a numeric array, equal for bitwise-identical arrays.
+
+    :param values: C-contiguous numpy array.
+    :return: Tuple of dtype, shape and a 128-bit blake2b digest of the data.
+    '''
+    digest = hashlib.blake2b(memoryview(values).cast('B'),digest_size=16).digest()
+    return((values.dtype.str, values.shape, digest))
+
+
+class ResultDeduplicator:
+    def __init__(self):
+        r'''
+        ResultDeduplicator recognizes results which are bitwise identical to an earlier result, e.g. when two function
+        relations are algebraically equivalent or a round trip through an inverse returns the input, such that their
+        storage can be shared. Results are indexed by fingerprint and candidates are compared bitwise, so equal
+        fingerprints never share storage by accident. Storage is shared across variables, but a result only counts as
+        duplicate of an earlier result of the same variable, see collapse.
+        '''
+        self.results = {}
+        self.named_results = set()
+    def __len__(self):
+        return(sum( len(results) for results in self.results.values() ))
+    def find_or_add(self,values):
+        r'''
+        Returns the earlier result which is bitwise identical to values, or adds values as new result and returns None.
+        Arrays which are not numeric are never deduplicated.
+
+        :param values: numpy array.
+        :return: numpy array or None.
+        '''
+        (result, added) = self._find_or_add(values)
+        return(None if added else result)
+    def _find_or_add(self,values):
+        r'''
+        Returns a tuple of the stored result which is bitwise identical to values and whether it was added by this call,
+        or (None, False) for arrays which are not numeric.
+
+        :param values: numpy array.
+        :return:
+        '''
+        if values.dtype.kind not in 'biufc':
+            return((None, False))
+        values = np.ascontiguousarray(values)
+        results = self.results.setdefault(fingerprint(values),[])
+        for result in results:
+            if np.array_equal(result.view(np.uint8),values.view(np.uint8)):
+                return((result, False))
+        results.append(values)
+        return((values, True))
+    def share(self,series):
+        r'''
+        Returns series, or a Series with the same index and name sharing the storage of an earlier bitwise-identical
+        result.
+
+        :param series: pandas Series.
+        :return: pandas Series.
+        '''
+        (series, _) = self.collapse(series)
+        return(series)
+    def collapse(self,series):
+        r'''
+        Shares the storage of series as share does, and determines if series duplicates an earlier result of the same
+        variable, i.e. with the same name. Results of other variables which happen to be identical only share storage.
+
+        :param series: pandas Series.
+        :return: Tuple of the pandas Series, see share, and True if it is a duplicate.
+        '''
+        (result, added) = self._find_or_add(series.to_numpy())
+        if result is None:
+            return((series, False))
+        named_result = (series.name, id(result))
+        duplicate = named_result in self.named_results
+        self.named_results.add(named_result)
+        if not added:
+            series = pd.Series(result,index=series.index,name=series.name,copy=False)
+        return((series, duplicate))
@@ -0,0 +1,249 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from Calculations import Calculation, LazyCalculation, ResultCache
+from ColumnStores import ColumnStore, MemmapColumnStore
+from Executors import run_sharded, run_steps
+from Profiling import RunStats
+
+
+def _cast(values,dtype):
+    r'''
+    Casts a pandas Series or numpy array to dtype without copying if it already has that dtype.
+
+    :param values: pandas Series or numpy array.
+    :param dtype: numpy dtype, None to not cast.
+    :return:
+    '''
+    if dtype is None:
+        return(values)
+    return(values.astype(dtype,copy=False))
+
+
+class PlanStep:
+    def __init__(self,node_id,col_name,function_relation,input_ids,input_variables):
+        r'''
+        PlanStep is a single numeric step of an ExecutionPlan.
+
+        :param node_id: Id of the CalculationNode computed by the step.
+        :param col_name: variable name of the calculation result.
+        :param function_relation: PartialFunctionRelation used to perform the calculation.
+        :param input_ids: Tuple of node ids of the input calculations.
+        :param input_variables: Tuple of variable names of the input calculations, aligned with input_ids.
+        '''
+        self.node_id = node_id
+        self.col_name = col_name
+        self.function_relation = function_relation
+        self.input_ids = tuple(input_ids)
+        self.input_variables = tuple(input_variables)
+    def __str__(self):
+        str_rep = f'{self.col_name}[{self.node_id}] <- {self.function_relation}{self.input_ids}'
+        return(str_rep)
+
+
+class ExecutionPlan:
+    def __init__(self,columns,calculation_graph,search_stats=None):
+        r'''
+        ExecutionPlan is the static result of the symbolic search of a FunctionSystem for a given set of input columns.
+        The steps are topologically ordered, i.e. the inputs of a step are either input columns or results of earlier
+        steps. Executing the plan only performs the numeric calculations.
+
+        :param columns: Iterable of input column names.
+        :param calculation_graph: CalculationGraph containing a node per input column followed by the derived nodes.
+        :param search_stats: RunStats recorded by the search which produced the plan.
+        '''
+        if search_stats is None:
+            search_stats = RunStats()
+        self.columns = tuple(columns)
+        self.calculation_graph = calculation_graph
+        self.search_stats = search_stats
+        self.steps = [
+            PlanStep(
+                node.node_id, node.col_name, node.function_relation,
+                (input_node.node_id for input_node in node.input_nodes), (input_node.col_name for input_node in node.input_nodes)
+            )
+            for node in calculation_graph if node.function_relation is not None
+        ]
+    def __len__(self):
+        return(len(self.calculation_graph))
+    def __str__(self):
+        str_rep = '\n'.join(str(step) for step in self.steps)
+        return(str_rep)
+    def get_nodes(self):
+        r'''
+        Returns the CalculationNodes of the plan indexed by node id.
+
+        :return:
+        '''
+        return(self.calculation_graph.nodes)
+    def get_labels(self):
+        r'''
+        Returns a unique label per node, ordered by node id. Input columns are labelled by their name, derived
+        calculations by their variable name followed by their node id, e.g. 'a[4]'.
+
+        :return:
+        '''
+        labels = [ node.col_name if node.function_relation is None else f'{node.col_name}[{node.node_id}]' for node in self.get_nodes() ]
+        return(labels)
+    def get_leaf_ids(self):
+        r'''
+        Returns the node ids of the input columns, ordered as the columns of the plan.
+
+        :return:
+        '''
+        leaf_ids = [ self.calculation_graph.get((col, None, frozenset())).node_id for col in self.columns ]
+        return(leaf_ids)
+    def execute(self,df,executor=None,max_workers=None,stats=None,dtype=None,deduplicator=None):
+        r'''
+        Performs the numeric calculations of the plan on the input dataframe df.
+
+        :param df: Pandas.DataFrame containing the columns the plan was compiled for.
+        :param executor: None to run the steps one at a time, or 'threads' or 'processes' to run independent steps in parallel.
+        :param max_workers: Maximum number of workers of the executor.
+        :param stats: RunStats to record the wall time of every step in.
+        :param dtype: numpy dtype to cast the input columns to once and to keep the results in, None to keep the dtypes as they are.
+        :param deduplicator: ResultDeduplicator with which bitwise-identical results share their storage, None to store every result separately.
+        :return: List of Calculations ordered by node id.
+        '''
+        share = (lambda series: series) if deduplicator is None else deduplicator.share
+        nodes = self.get_nodes()
+        calculations = [None]*len(nodes)
+        for (col, leaf_id) in zip(self.columns, self.get_leaf_ids()):
+            calculations[leaf_id] = Calculation(col, share(_cast(df[col],dtype)), node=nodes[leaf_id])
+
+        def prepare(step):
+            input_df = pd.concat([ calculations[input_id].col_df for input_id in step.input_ids ],axis=1)
+            return(input_df)
+        def finish(step,output):
+            input_calculations = frozenset( calculations[input_id] for input_id in step.input_ids )
+            calculations[step.node_id] = Calculation(step.col_name, share(_cast(output,dtype)), function_relation=step.function_relation, history=input_calculations, node=nodes[step.node_id])
+
+        run_steps(self.steps,self.get_leaf_ids(),prepare,finish,'compute_variable',executor=executor,max_workers=max_workers,stats=stats)
+        return(calculations)
+    def execute_lazy(self,df,cache_size=None,dtype=None):
+        r'''
+        Prepares the calculations of the plan on the input dataframe df as LazyCalculations, of which the numeric result
+        is only computed when its col_df is accessed.
+
+        :param df: Pandas.DataFrame containing the columns the plan was compiled for.
+        :param cache_size: None to memoize every computed result, or the maximum number of results kept in a shared least recently used ResultCache.
+        :param dtype: numpy dtype to cast the input columns to once and to keep the results in, None to keep the dtypes as they are.
+        :return: List of Calculations ordered by node id, the input columns as Calculations and the others as LazyCalculations.
+        '''
+        result_cache = None if cache_size is None else ResultCache(cache_size)
+        nodes = self.get_nodes()
+        calculations = [None]*len(nodes)
+        for (col, leaf_id) in zip(self.columns, self.get_leaf_ids()):
+            calculations[leaf_id] = Calculation(col, _cast(df[col],dtype), node=nodes[leaf_id])
+        for step in self.steps:
+            input_calculations = [ calculations[input_id] for input_id in step.input_ids ]
+            calculations[step.node_id] = LazyCalculation(step.col_name, step.function_relation, input_calculations, node=nodes[step.node_id], result_cache=result_cache, dtype=dtype)
+        return(calculations)
+    def execute_columnar(self,df,dtype=np.float64,executor=None,max_workers=None,stats=None,directory=None,buffer_pool=None):
+        r'''
+        Performs the numeric calculations of the plan on the input dataframe df, keeping all results in a ColumnStore.
+        Function relations receive zero-copy views of their input columns and their output is written into the store.
+
+        :param df: Pandas.DataFrame containing the columns the plan was compiled for.
+        :param dtype: numpy dtype of the stored results.
+        :param executor: None to run the steps one at a time, or 'threads' or 'processes' to run independent steps in parallel.
+        :param max_workers: Maximum number of workers of the executor.
+        :param stats: RunStats to record the wall time of every step in.
+        :param directory: None to keep the results in memory, or the path of a directory to store them in a memory-mapped file, see MemmapColumnStore.
+        :param buffer_pool: BufferPool to evaluate the steps in place with, see compute_columnar.
+        :return: ColumnStore
+        '''
+        if directory is None:
+            store = ColumnStore(self,df.index,dtype=dtype)
+        else:
+            store = MemmapColumnStore(self,df.index,dtype=dtype,directory=directory)
+        for (col, leaf_id) in zip(self.columns, self.get_leaf_ids()):
+            store.write(leaf_id, df[col].to_numpy())
+        self.compute_columnar(store,executor=executor,max_workers=max_workers,stats=stats,buffer_pool=buffer_pool)
+        store.flush()
+        return(store)
+    def evaluate_record(self,record):
+        r'''
+        Performs the numeric calculations of the plan on a single record of scalars, or on a small batch of records as
+        1-D arrays, without constructing pandas objects.
+
+        :param record: Mapping of the input column names of the plan to scalars or 1-D numpy arrays.
+        :return: Dict of label, see get_labels, to the result of the node.
+        '''
+        values = [None]*len(self)
+        for (col, leaf_id) in zip(self.columns, self.get_leaf_ids()):
+            values[leaf_id] = record[col]
+        for step in self.steps:
+            columns = { variable:values[input_id] for (variable, input_id) in zip(step.input_variables, step.input_ids) }
+            values[step.node_id] = step.function_relation.compute_array(columns,step.col_name)
+        return(dict(zip(self.get_labels(), values)))
+    def execute_sharded(self,df,n_workers=None,dtype=np.float64):
+        r'''
+        Performs the numeric calculations of the plan on the input dataframe df, split into row ranges which are
+        evaluated by parallel worker processes on inputs and outputs in shared memory, see Executors.run_sharded.
+
+        :param df: Pandas.DataFrame containing the columns the plan was compiled for.
+        :param n_workers: Number of worker processes, defaults to the number of CPUs.
+        :param dtype: numpy dtype of the stored results.
+        :return: ColumnStore
+        '''
+        return(run_sharded(self,df,dtype=dtype,n_workers=n_workers))
+    def get_dependent_steps(self,node_ids):
+        r'''
+        Returns the steps whose calculation history includes any of the given nodes, in plan order.
+
+        :param node_ids: Iterable of node ids.
+        :return: List of PlanSteps.
+        '''
+        changed_ids = set(node_ids)
+        dependent_steps = []
+        for step in self.steps:
+            if any( input_id in changed_ids for input_id in step.input_ids ):
+                changed_ids.add(step.node_id)
+                dependent_steps.append(step)
+        return(dependent_steps)
+    def compute_columnar(self,store,steps=None,executor=None,max_workers=None,stats=None,buffer_pool=None):
+        r'''
+        Performs the numeric calculations of the given steps on a ColumnStore of the plan, in which the inputs of the
+        steps have already been written. The results of all other nodes are left as they are.
+
+        With a buffer_pool the steps are run one at a time and every result is written directly into its column of the
+        store with out= buffers, see SymbolicFunctionRelation.compute_array, such that no result arrays are allocated
+        and temporaries are reused.
+
+        :param store: ColumnStore of the plan.
+        :param steps: List of PlanSteps in plan order, defaults to all steps.
+        :param executor: None, 'threads' or 'processes', see execute_columnar.
+        :param max_workers: Maximum number of workers of the executor.
+        :param stats: RunStats to record the wall time of every step in.
+        :param buffer_pool: BufferPool to evaluate the steps in place with, None to write the returned results into the store.
+        :return:
+        '''
+        if steps is None:
+            steps = self.steps
+        if buffer_pool is not None:
+            if executor is not None:
+                msg = 'In-place evaluation with a buffer pool runs the steps one at a time and does not support an executor.'
+                raise ValueError(msg)
+            for step in steps:
+                start = time.perf_counter()
+                columns = store.view(dict(zip(step.input_variables, step.input_ids)))
+                step.function_relation.compute_array(columns,step.col_name,out=store.column(step.node_id),pool=buffer_pool)
+                if stats is not None:
+                    stats.record_step(step,time.perf_counter()-start)
+            return
+        computed_ids = set( step.node_id for step in steps )
+        ready_ids = [ node.node_id for node in self.get_nodes() if node.node_id not in computed_ids ]
+
+        def prepare(step):
+            columns = store.view(dict(zip(step.input_variables, step.input_ids)))
+            if executor == 'processes':
+                # Worker processes receive plain arrays instead of a view on the whole store
+                columns = columns.to_dict()
+            return(columns)
+        def finish(step,output):
+            store.write(step.node_id, output)
+
+        run_steps(steps,ready_ids,prepare,finish,'compute_array',executor=executor,max_workers=max_workers,stats=stats)
@@ -0,0 +1,217 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing.shared_memory import SharedMemory
+import multiprocessing
+import time
+
+import numpy as np
+import pandas as pd
+
+from ColumnStores import ColumnStore
+
+# Steps of the plan executed by a worker process, set once per worker by _initialize_worker
+_worker_steps = None
+
+# Plan evaluated by a shard worker process, set once per worker by _initialize_shard_worker
+_worker_plan = None
+
+def _initialize_worker(steps):
+    r'''
+    Stores the plan steps in the worker process, such that tasks only need to transfer the step position and the data.
+
+    :param steps: List of PlanSteps.
+    :return:
+    '''
+    global _worker_steps
+    _worker_steps = steps
+
+def _compute_step(step,inputs,method):
+    r'''
+    Computes a single step with the given method of its function relation, either 'compute_variable' or 'compute_array'.
+
+    :param step: PlanStep
+    :param inputs: pandas DataFrame or mapping of variable names to arrays.
+    :param method: Name of the PartialFunctionRelation method to use.
+    :return:
+    '''
+    return(getattr(step.function_relation,method)(inputs,step.col_name))
+
+def _timed_compute_step(step,inputs,method):
+    r'''
+    Computes a single step like _compute_step, and measures its wall time.
+
+    :return: Tuple of the output and the elapsed seconds.
+    '''
+    start = time.perf_counter()
+    output = _compute_step(step,inputs,method)
+    return((output, time.perf_counter()-start))
+
+def _compute_step_in_worker(position,inputs,method):
+    return(_compute_step(_worker_steps[position],inputs,method))
+
+def _timed_compute_step_in_worker(position,inputs,method):
+    return(_timed_compute_step(_worker_steps[position],inputs,method))
+
+def _get_mp_context():
+    r'''
+    Returns the fork multiprocessing context where available, such that function relations holding lambdas are
+    inherited by worker processes instead of pickled, else None for the default context.
+
+    :return:
+    '''
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return(multiprocessing.get_context('fork'))
+    return(None)
+
+def create_executor(executor,steps,max_workers=None):
+    r'''
+    Creates a concurrent.futures executor for the given plan steps.
+
+    For 'processes' the fork start method is used where available, such that function relations holding lambdas are
+    inherited by the workers instead of pickled. On platforms without fork the function relations must be picklable.
+
+    :param executor: 'threads' or 'processes'.
+    :param steps: List of PlanSteps which will be executed.
+    :param max_workers: Maximum number of workers, defaults to the concurrent.futures default.
+    :return:
+    '''
+    if executor == 'threads':
+        return(ThreadPoolExecutor(max_workers=max_workers))
+    elif executor == 'processes':
+        return(ProcessPoolExecutor(max_workers=max_workers, mp_context=_get_mp_context(), initializer=_initialize_worker, initargs=(steps,)))
+    else:
+        msg = f'Unknown executor: {executor}'
+        raise ValueError(msg)
+
+def run_steps(steps,ready_ids,prepare,finish,method,executor=None,max_workers=None,stats=None):
+    r'''
+    Runs plan steps in dependency order. Without executor the steps are run one at a time in plan order. With an
+    executor every step is submitted as soon as all of its inputs are available, such that independent steps run in
+    parallel.
+
+    :param steps: List of topologically ordered PlanSteps.
+    :param ready_ids: Iterable of node ids which are available before any step is run, i.e. the input columns.
+    :param prepare: Function taking a PlanStep and returning its inputs, called in the calling thread.
+    :param finish: Function taking a PlanStep and its output, called in the calling thread.
+    :param method: Name of the PartialFunctionRelation method to compute a step with.
+    :param executor: None, 'threads' or 'processes'.
+    :param max_workers: Maximum number of workers.
+    :param stats: RunStats to record the wall time of every step in, measured where the step is computed.
+    :return:
+    '''
+    if stats is None:
+        compute, compute_in_worker = _compute_step, _compute_step_in_worker
+    else:
+        compute, compute_in_worker = _timed_compute_step, _timed_compute_step_in_worker
+        untimed_finish = finish
+        def finish(step,timed_output):
+            (output, elapsed) = timed_output
+            stats.record_step(step,elapsed)
+            untimed_finish(step,output)
+
+    if executor is None:
+        for step in steps:
+            finish(step,compute(step,prepare(step),method))
+        return
+
+    # Count the unavailable inputs per step and index the steps per input
+    ready_ids = set(ready_ids)
+    remaining_inputs = {}
+    dependent_steps = {}
+    for (position, step) in enumerate(steps):
+        remaining_inputs[position] = sum( 1 for input_id in step.input_ids if input_id not in ready_ids )
+        for input_id in step.input_ids:
+            dependent_steps.setdefault(input_id,[]).append(position)
+
+    with create_executor(executor,steps,max_workers=max_workers) as pool:
+        def submit(position):
+            step = steps[position]
+            if isinstance(pool,ProcessPoolExecutor):
+                future = pool.submit(compute_in_worker,position,prepare(step),method)
+            else:
+                future = pool.submit(compute,step,prepare(step),method)
+            running[future] = position
+
+        running = {}
+        for (position, count) in remaining_inputs.items():
+            if count == 0:
+                submit(position)
+        while running:
+            done, _ = wait(running,return_when=FIRST_COMPLETED)
+            for future in done:
+                step = steps[running.pop(future)]
+                finish(step,future.result())
+                for position in dependent_steps.get(step.node_id,()):
+                    remaining_inputs[position] -= 1
+                    if remaining_inputs[position] == 0:
+                        submit(position)
+
+def _initialize_shard_worker(plan):
+    r'''
+    Stores the plan in the worker process, such that shard tasks only need to transfer the location of the shard.
+
+    :param plan: ExecutionPlan
+    :return:
+    '''
+    global _worker_plan
+    _worker_plan = plan
+
+def _compute_shard(shared_memory_name,shape,dtype,start,stop):
+    r'''
+    Evaluates the plan of the worker for the rows start to stop of the results array in shared memory, of which the
+    input columns have been written.
+
+    :param shared_memory_name: Name of the SharedMemory block holding the results array.
+    :param shape: Tuple of the shape of the results array.
+    :param dtype: numpy dtype of the results array.
+    :param start: First row of the shard.
+    :param stop: Row after the last row of the shard.
+    :return:
+    '''
+    shared_memory = SharedMemory(name=shared_memory_name)
+    try:
+        data = np.ndarray(shape,dtype=dtype,buffer=shared_memory.buf,order='F')
+        store = ColumnStore(_worker_plan,pd.RangeIndex(stop-start),data=data[start:stop])
+        _worker_plan.compute_columnar(store)
+    finally:
+        # The shared memory can only be closed once no arrays refer to it
+        data = store = None
+        shared_memory.close()
+
+def run_sharded(plan,df,dtype=np.float64,n_workers=None):
+    r'''
+    Evaluates a plan on df with row shards in parallel worker processes. The input columns are written once into a
+    results array in shared memory, every worker evaluates all steps for its range of rows and writes its results into
+    the same array. No data is pickled per shard.
+
+    :param plan: ExecutionPlan
+    :param df: Pandas.DataFrame containing the columns the plan was compiled for.
+    :param dtype: numpy dtype of the stored results.
+    :param n_workers: Number of worker processes, defaults to the number of CPUs.
+    :return: ColumnStore
+    '''
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    shape = (len(df.index),len(plan))
+    shared_memory = SharedMemory(create=True,size=max(1,int(np.prod(shape))*np.dtype(dtype).itemsize))
+    try:
+        data = np.ndarray(shape,dtype=dtype,buffer=shared_memory.buf,order='F')
+        for (col, leaf_id) in zip(plan.columns, plan.get_leaf_ids()):
+            data[:,leaf_id] = df[col].to_numpy()
+
+        bounds = np.linspace(0,shape[0],min(n_workers,max(1,shape[0]))+1).astype(int)
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=_get_mp_context(), initializer=_initialize_shard_worker, initargs=(plan,)) as pool:
+            futures = [
+                pool.submit(_compute_shard,shared_memory.name,shape,dtype,start,stop)
+                for (start, stop) in zip(bounds[:-1], bounds[1:]) if stop > start
+            ]
+            for future in futures:
+                future.result()
+
+        # The shared memory is released on return, hence the results are copied into a store owning its memory
+        store = ColumnStore(plan,df.index,dtype=dtype)
+        store.data[:] = data
+    finally:
+        data = None
+        shared_memory.close()
+        shared_memory.unlink()
+    return(store)
@@ -1,8 +1,12 @@
+import numpy as np
 import sympy
 import warnings
 import traceback
 import re
 
+from InPlaceEvaluators import InPlaceEvaluator
+from InversionCache import InversionCache
+
 class PartialFunctionRelation:
     def __init__(self,function_dict,all_variables):
         r'''
@@ -52,6 +56,22 @@ class PartialFunctionRelation:
         output = self.function_dict[output_variable](df[input_variables])
         output.rename(output_variable, inplace=True)
         return(output)
+    def compute_array(self,columns,output_variable,out=None,pool=None):
+        r'''
+        Calculate the output_variable from a mapping of variable names to arrays using this function relation. Unlike
+        compute_variable no pandas objects are constructed, the functions receive the arrays as they are.
+
+        :param columns: Mapping of input variable names to numpy arrays, e.g. a ColumnView.
+        :param output_variable:
+        :param out: Optional preallocated numpy array to write the result into.
+        :param pool: Optional BufferPool for temporaries, only used by relations which can evaluate in place.
+        :return: numpy.ndarray, out if given.
+        '''
+        output = np.asarray(self.function_dict[output_variable](columns))
+        if out is None:
+            return(output)
+        out[...] = output
+        return(out)
     def get_all_variables(self):
         r'''
         Returns all variables in the function relation.
@@ -119,23 +139,90 @@ class FunctionRelation(PartialFunctionRelation):
         super(FunctionRelation,self).__init__(function_dict,function_dict.keys())
 
 class SymbolicFunctionRelation(PartialFunctionRelation):
-    def __init__(self,function_relation,variables,constants=None):
+    def __init__(self,function_relation,variables,constants=None,cache=None,solutions=None):
         r'''
         A user-friendly helper class to construct a function relation from a string formatted relation.
 
         :param function_relation: Str formatted function relation.
         :param all_variables: List-like of variables used in the function relation.
         :param constants: Dict-like of (constant_name,constant_value) pairs of constants used in the fucntion relation.
+        :param cache: InversionCache or path of a cache directory to store the sympy inversions in, None to not cache.
+        :param solutions: Dict of variable name to solved sympy expression or None, see solve_inversions. If given, the
+        formula is not solved again.
         '''
         if constants is None:
             constants = dict()
+        if cache is not None and not isinstance(cache,InversionCache):
+            cache = InversionCache(cache)
         self.function_relation = function_relation
         self.variables = frozenset(variables)
         self.constants = constants
+        self.cache = cache
+        self.solutions = solutions
+        self.inplace_evaluators = {}
         self.to_function_relation()
     def __str__(self):
         str_rep = f'SymbolicFunctionRelation: {self.function_relation}'
         return(str_rep)
+    def __getstate__(self):
+        r'''
+        Returns the picklable state of the relation. The lambdified functions are not picklable, hence only the formula
+        and the solutions in srepr format are stored, from which the functions are rebuilt without solving again.
+
+        :return:
+        '''
+        solutions = {
+            variable_name:( None if solution is None else sympy.srepr(solution) )
+            for (variable_name, solution) in self.solutions.items()
+        }
+        state = {
+            'function_relation': self.function_relation,
+            'variables': sorted(self.variables),
+            'constants': self.constants,
+            'cache': self.cache,
+            'solutions': solutions,
+        }
+        return(state)
+    def __setstate__(self,state):
+        solutions = {
+            variable_name:( None if solution is None else sympy.sympify(solution) )
+            for (variable_name, solution) in state['solutions'].items()
+        }
+        self.__init__(state['function_relation'],state['variables'],constants=state['constants'],cache=state['cache'],solutions=solutions)
+    def compute_array(self,columns,output_variable,out=None,pool=None):
+        r'''
+        Calculate the output_variable from a mapping of variable names to arrays, see
+        PartialFunctionRelation.compute_array. If out is given, the solution is evaluated in place into out with
+        temporaries from pool where possible, see InPlaceEvaluator.
+
+        :param columns: Mapping of input variable names to numpy arrays, e.g. a ColumnView.
+        :param output_variable:
+        :param out: Optional preallocated numpy array to write the result into.
+        :param pool: Optional BufferPool for temporaries.
+        :return: numpy.ndarray, out if given.
+        '''
+        if out is not None:
+            evaluator = self.get_inplace_evaluator(output_variable)
+            if evaluator is not None:
+                return(evaluator(columns,out,pool))
+        return(super(SymbolicFunctionRelation,self).compute_array(columns,output_variable,out=out))
+    def get_inplace_evaluator(self,output_variable):
+        r'''
+        Returns the InPlaceEvaluator of the solution for output_variable, or None if the solution can not be evaluated
+        in place. Evaluators are created on first use.
+
+        :param output_variable:
+        :return:
+        '''
+        try:
+            return(self.inplace_evaluators[output_variable])
+        except KeyError:
+            try:
+                evaluator = InPlaceEvaluator(self.solutions[output_variable])
+            except NotImplementedError:
+                evaluator = None
+            self.inplace_evaluators[output_variable] = evaluator
+            return(evaluator)
     def transform_variables_to_sympy(self):
         try:
             self.sympy_variables
@@ -143,41 +230,106 @@ class SymbolicFunctionRelation(PartialFunctionRelation):
             self.sympy_variables = {v:sympy.symbols(v) for v in self.variables}
     def transform_formula_to_sympy(self):
         self.transform_variables_to_sympy()
-        hash_map = {v:hash(v) for v in self.variables}
-        hash_fr = self.function_relation
-        for variable in self.variables:
-            pattern = r'\b{variable}\b'.format(variable=variable)
-            repl = str(hash_map[variable])
-            hash_fr = re.sub(pattern,repl,hash_fr)
-        for constant_name,constant_value in self.constants.items():
-            pattern = r'\b{constant_name}\b'.format(constant_name=constant_name)
-            repl = constant_value.__repr__()
-            hash_fr = re.sub(pattern,repl,hash_fr)
-        for variable in self.variables:
-            pattern = str(hash_map[variable])
-            repl = "self.sympy_variables['{variable}']".format(variable=variable)
-            hash_fr = re.sub(pattern,repl,hash_fr)
-        hash_fr = hash_fr.replace('=','-')
-        self.sympy_function_relation = eval(hash_fr)
+        self.sympy_function_relation = formula_to_sympy(self.function_relation,self.sympy_variables,self.constants)
+    def solve_inversions(self):
+        r'''
+        Solves the formula for every variable with sympy, or loads the solutions from the cache if available.
+
+        :return: Dict of variable name to the solved sympy expression, or None if it is not uniquely invertible.
+        '''
+        if self.cache is not None:
+            cache_key = self.cache.get_key(self.sympy_function_relation,self.variables,self.constants)
+            solutions = self.cache.get(cache_key)
+            if solutions is not None:
+                return(solutions)
+        solutions = {}
+        for (variable_name, variable) in self.sympy_variables.items():
+            solutions[variable_name] = solve_inversion(self.sympy_function_relation,variable)
+        if self.cache is not None:
+            self.cache.set(cache_key,solutions)
+        return(solutions)
     def to_function_relation(self):
         self.transform_variables_to_sympy()
         self.transform_formula_to_sympy()
+        if self.solutions is None:
+            self.solutions = self.solve_inversions()
         func_dict = {}
         variables = self.sympy_variables
-        formula = self.sympy_function_relation
-        for variable in variables:
-            try:
-                res_formula = sympy.solve(formula,variable)
-                if len(res_formula)>1:
-                    raise NotImplementedError('No implementation for formula with multiple inversion solutions.')
-                res_formula = res_formula[0]
-                input = tuple(v for v in variables if v != variable)
-                function = sympy.lambdify(input,res_formula)
-                function = lambda df,function=function,input=input: function(*tuple(df[str(v)] for v in input))
-                func_dict[str(variable)] = function
-            except NotImplementedError as nie:
-                traceback.print_exception(nie)
-                warnings.warn(f'Skipping variable {variable} because it is not uniquely invertible for sympy.')
-        variables = frozenset( str(v) for v in variables )
+        for (variable_name, res_formula) in self.solutions.items():
+            if res_formula is None:
+                warnings.warn(f'Skipping variable {variable_name} because it is not uniquely invertible for sympy.')
+                continue
+            input = tuple(v for v in variables.values() if str(v) != variable_name)
+            function = sympy.lambdify(input,res_formula)
+            function = lambda df,function=function,input=input: function(*tuple(df[str(v)] for v in input))
+            func_dict[variable_name] = function
+        variables = frozenset( str(v) for v in variables.values() )
         super(SymbolicFunctionRelation,self).__init__(func_dict,variables)
 
+
+# Identifiers of a formula, attributes such as the sin in sympy.sin are not identifiers of the formula
+_IDENTIFIER_PATTERN = re.compile(r'(?<![\w.])[A-Za-z_]\w*')
+
+def get_identifiers(function_relation):
+    r'''
+    Extracts the identifiers used in a str formatted function relation in a single pass.
+
+    :param function_relation: Str formatted function relation.
+    :return: Set of identifier names.
+    '''
+    return(set(_IDENTIFIER_PATTERN.findall(function_relation)))
+
+def formula_to_sympy(function_relation,sympy_variables,constants):
+    r'''
+    Transforms a str formatted function relation into a sympy expression which equals zero. A relation 'lhs = rhs' is
+    transformed into lhs - (rhs), a formula without '=' is taken to equal zero. Variables and constants are resolved by
+    a single dict lookup per identifier while the expression is evaluated.
+
+    :param function_relation: Str formatted function relation.
+    :param sympy_variables: Dict of variable name to sympy Symbol.
+    :param constants: Dict-like of (constant_name,constant_value) pairs.
+    :return: sympy expression.
+    '''
+    sides = function_relation.split('=')
+    if len(sides) > 2:
+        msg = f'A function relation can contain at most one "=", got {function_relation}'
+        raise ValueError(msg)
+    namespace = {'sympy':sympy}
+    namespace.update(constants)
+    namespace.update(sympy_variables)
+    expressions = [ eval(side,namespace) for side in sides ]
+    if len(expressions) == 1:
+        return(sympy.sympify(expressions[0]))
+    return(sympy.sympify(expressions[0] - (expressions[1])))
+
+def solve_inversion(formula,variable):
+    r'''
+    Solves formula = 0 for variable.
+
+    :param formula: sympy expression.
+    :param variable: sympy Symbol.
+    :return: The solved sympy expression, or None if the formula is not uniquely invertible for sympy.
+    '''
+    try:
+        res_formula = sympy.solve(formula,variable)
+        if len(res_formula)>1:
+            raise NotImplementedError('No implementation for formula with multiple inversion solutions.')
+        return(res_formula[0])
+    except NotImplementedError as nie:
+        traceback.print_exception(nie)
+        return(None)
+
+def solve_inversion_srepr(formula_srepr,variable_name):
+    r'''
+    Solves formula = 0 for variable_name, with the formula and solution in srepr format. This allows the inversions to be
+    solved in worker processes without pickling sympy objects.
+
+    :param formula_srepr: Str srepr of a sympy expression.
+    :param variable_name: Str variable name.
+    :return: Str srepr of the solved sympy expression, or None if the formula is not uniquely invertible for sympy.
+    '''
+    formula = sympy.sympify(formula_srepr)
+    res_formula = solve_inversion(formula,sympy.Symbol(variable_name))
+    if res_formula is None:
+        return(None)
+    return(sympy.srepr(res_formula))
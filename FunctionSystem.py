@@ -1,139 +1,598 @@
-from functools import reduce
-from itertools import product
-import re
+from concurrent.futures import ProcessPoolExecutor
+import time
+
+import numpy as np
 import pandas as pd
+import sympy
 
-from Calculations import Calculation, HypotheticalCalculation
-from FunctionRelations import SymbolicFunctionRelation
+from Calculations import Calculation, CalculationGraph
+from Deduplication import ResultDeduplicator
+from ExecutionPlan import ExecutionPlan
+from FusedPlan import FusedPlan
+from Streaming import ChunkWriter, iterate_chunks
+from FunctionRelations import SymbolicFunctionRelation, formula_to_sympy, get_identifiers, solve_inversion_srepr
+from InPlaceEvaluators import BufferPool
+from InversionCache import InversionCache
+from Profiling import RunStats
+from Reconciliation import reconcile
+from Serialization import save
+from Sessions import Session
 
 class FunctionSystem:
-    def __init__(self,function_relations):
+    def __init__(self,function_relations,dtype=None):
         r'''
         A FunctionSystem is a class which represents a collection of function relations which form one consistent whole. The basic example of a FunctionSystem is that of a physical model. In physics we often have a number of functional relations for a particular set up. These exist in parts, a small number of variables sharing one relation, while the whole system may consist of many such relations. We also may be able to measure a large number of these variables. A physics student is often asked to calculate one variable based on the other, but in reality it may be more interesting to compare both measured values and calculated values. This class can be used to perform all these calculations at once, taking away human error in computing inverse and replacing the manual labor of implementing such functions by hand.
 
         :param function_relations: Iterable of (Partial-)FunctionRelation objects.
+        :param dtype: numpy dtype policy of the system, e.g. numpy.float32. Input columns are cast to it once and all results are kept in it. None keeps the dtypes of the pandas backend as they are and uses float64 for the other backends.
         '''
         self.function_relations = list(function_relations)
+        self.dtype = dtype
+        self.plans = {}
+        self.fused_plans = {}
+        self.buffer_pool = BufferPool()
     def append(self,function_relation):
         r'''
-        Adds an existing (Partial-)FunctionRelation to the FunctionSystem.
+        Adds an existing (Partial-)FunctionRelation to the FunctionSystem. This invalidates all compiled plans.
 
         :param function_relation: PartialFunctionRelation or FunctionRelation.
         :return:
         '''
         self.function_relations.append(function_relation)
-    def __call__(self,df):
+        self.plans.clear()
+        self.fused_plans.clear()
+    def __getstate__(self):
+        r'''
+        Returns the picklable state of the FunctionSystem, including the compiled plans. Fused plans hold generated
+        functions, hence they are not stored and are generated again when they are used.
+
+        :return:
+        '''
+        state = self.__dict__.copy()
+        state['fused_plans'] = {}
+        return(state)
+    def get_array_dtype(self):
+        r'''
+        Returns the dtype of the results of the array backends according to the dtype policy.
+
+        :return:
+        '''
+        return(np.float64 if self.dtype is None else self.dtype)
+    def save(self,path):
+        r'''
+        Saves the FunctionSystem with its compiled plans to a file, see Serialization.save.
+
+        :param path: Path of the file.
+        :return:
+        '''
+        save(self,path)
+    def __call__(self,df,backend='pandas',executor=None,max_workers=None,targets=None,max_depth=None,max_calculations=None,lazy=False,cache_size=None,stats=None,directory=None,inplace=False,dedup=None):
         r'''
         Performs the actual calculation of the FunctionSystem based on the input dataframe df. In any Calculation a function relation is only used at most once in the calculation history. The system will perform all possible calculations under this rule. It will be able to complete missing columns as long as it has a function relation which allows the compuation of the missing column.
 
+        The symbolic search only depends on the columns of df, hence it is compiled once per set of columns, see compile.
+
         :param df: Pandas.DataFrame with column names matching the variable names used in the FunctionRelations..
+        :param backend: 'pandas' to return a list of Calculations holding a pandas Series each, 'numpy' to return a ColumnStore holding all results in one 2-D array, or 'fused' to compute the ColumnStore with one generated function, see fuse.
+        :param executor: None to perform the calculations one at a time, or 'threads' or 'processes' to perform calculations whose inputs are available in parallel.
+        :param max_workers: Maximum number of workers of the executor.
+        :param targets: Iterable of variable names, if given only calculations contributing to these variables are performed, see compile.
+        :param max_depth: Maximum number of function relations chained in a single calculation, see compile.
+        :param max_calculations: Maximum number of calculations the search derives, see compile.
+        :param lazy: If True, the pandas backend returns LazyCalculations which are only computed when their col_df is accessed.
+        :param cache_size: Maximum number of results of LazyCalculations kept in memory, None to keep every computed result.
+        :param stats: RunStats to collect the numeric wall time per function relation in, and the search counters if the plan is compiled by this run. Only supported by the pandas and numpy backends without lazy calculations.
+        :param directory: Path of a directory in which the numpy backend stores the results as a memory-mapped file, such that runs larger than memory complete, see ColumnStores.open_results to reopen them.
+        :param inplace: If True, the numpy backend evaluates symbolic relations into preallocated out= buffers with temporaries from the buffer pool of the system, see ExecutionPlan.compute_columnar.
+        :param dedup: None, 'share' to let bitwise-identical results of the pandas backend share their storage, or 'collapse' to additionally not use such duplicates as input for further calculations, see _execute_collapsed.
         :return:
         '''
-        # Create a list of performed calculations
-        calculations = [ (col,frozenset(),df[col]) for col in df.columns ]
-        calculations = [Calculation(col, df[col]) for col in df.columns]
+        if dedup not in (None, 'share', 'collapse'):
+            msg = f'Unknown dedup option: {dedup}'
+            raise ValueError(msg)
+        if dedup is not None and (backend != 'pandas' or lazy):
+            msg = 'Deduplication is only supported by the pandas backend without lazy calculations.'
+            raise ValueError(msg)
+        if stats is not None and (backend not in ('pandas', 'numpy') or lazy):
+            msg = 'Run statistics are only supported by the pandas and numpy backends without lazy calculations.'
+            raise ValueError(msg)
+        if dedup == 'collapse':
+            if executor is not None:
+                msg = 'Collapsing duplicate results evaluates during the search and does not support an executor.'
+                raise ValueError(msg)
+            return(self._execute_collapsed(df,targets=targets,max_depth=max_depth,max_calculations=max_calculations,stats=stats))
+        if inplace and backend != 'numpy':
+            msg = f'In-place evaluation is only supported by the numpy backend, got backend {backend}.'
+            raise ValueError(msg)
+        if directory is not None and backend != 'numpy':
+            msg = f'Memory-mapped results are only supported by the numpy backend, got backend {backend}.'
+            raise ValueError(msg)
+        if lazy and (backend != 'pandas' or executor is not None):
+            msg = 'Lazy calculations are only supported by the pandas backend without executor.'
+            raise ValueError(msg)
+        if cache_size is not None and not lazy:
+            msg = 'A cache size is only supported for lazy calculations.'
+            raise ValueError(msg)
+        if backend == 'fused' and (executor is not None or max_workers is not None):
+            msg = 'The fused backend computes all calculations with one generated function and does not support an executor.'
+            raise ValueError(msg)
+        plan_options = dict(targets=targets,max_depth=max_depth,max_calculations=max_calculations)
+        plan = self.compile(df.columns,stats=stats,**plan_options)
+        if backend == 'pandas' and lazy:
+            return(plan.execute_lazy(df,cache_size=cache_size,dtype=self.dtype))
+        elif backend == 'pandas':
+            deduplicator = None if dedup is None else ResultDeduplicator()
+            return(plan.execute(df,executor=executor,max_workers=max_workers,stats=stats,dtype=self.dtype,deduplicator=deduplicator))
+        elif backend == 'numpy':
+            buffer_pool = self.buffer_pool if inplace else None
+            return(plan.execute_columnar(df,dtype=self.get_array_dtype(),executor=executor,max_workers=max_workers,stats=stats,directory=directory,buffer_pool=buffer_pool))
+        elif backend == 'fused':
+            return(self.fuse(df.columns,**plan_options)(df,dtype=self.get_array_dtype()))
+        else:
+            msg = f'Unknown backend: {backend}'
+            raise ValueError(msg)
+    def stream(self,source,chunksize=100_000,executor=None,max_workers=None):
+        r'''
+        Evaluates the FunctionSystem chunk by chunk. The plan is compiled once for the columns of the first chunk, and
+        every chunk is evaluated with the numpy backend, such that peak memory is bounded by the chunk size.
 
-        # Set a boolean to keep track of continuing calculations
-        performed_new_calculations = True
-        while performed_new_calculations:
-            # Reset boolean
-            performed_new_calculations = False
+        :param source: Iterable of pandas DataFrames, or a path to a CSV or parquet file which is read in chunks.
+        :param chunksize: Number of rows per chunk when reading from a path.
+        :param executor: None, 'threads' or 'processes', see __call__.
+        :param max_workers: Maximum number of workers of the executor.
+        :return: Generator of pandas DataFrames with a column per calculation, labelled as in ExecutionPlan.get_labels.
+        '''
+        plan = None
+        for chunk in iterate_chunks(source,chunksize=chunksize):
+            if plan is None:
+                plan = self.compile(chunk.columns)
+            elif frozenset(chunk.columns) != frozenset(plan.columns):
+                msg = f'All chunks must have the same columns, expected {sorted(plan.columns)} but got {sorted(chunk.columns)}'
+                raise ValueError(msg)
+            store = plan.execute_columnar(chunk,dtype=self.get_array_dtype(),executor=executor,max_workers=max_workers)
+            yield(store.to_frame())
+    def stream_to_file(self,source,path,chunksize=100_000,executor=None,max_workers=None):
+        r'''
+        Evaluates the FunctionSystem chunk by chunk, see stream, and appends the results of every chunk to a file. The
+        index of the chunks is not written.
 
-            # Iterate of all possible function relations we can choose
-            for func_rel in self.function_relations:
+        :param source: Iterable of pandas DataFrames, or a path to a CSV or parquet file which is read in chunks.
+        :param path: Path of the output file, written as parquet if it ends with .parquet or .pq, else as CSV.
+        :param chunksize: Number of rows per chunk when reading from a path.
+        :param executor: None, 'threads' or 'processes', see __call__.
+        :param max_workers: Maximum number of workers of the executor.
+        :return: Number of rows written.
+        '''
+        with ChunkWriter(path) as writer:
+            for result_chunk in self.stream(source,chunksize=chunksize,executor=executor,max_workers=max_workers):
+                writer.write(result_chunk)
+        return(writer.rows_written)
+    def compile(self,columns,targets=None,max_depth=None,max_calculations=None,stats=None):
+        r'''
+        Compiles the FunctionSystem into an ExecutionPlan for the given input columns. Plans are cached per set of columns
+        and options.
+
+        If targets are given, the search is goal-directed: by chaining backward from the targets through the function
+        relations only the outputs which can contribute to a target are searched for, and afterwards only calculations
+        used by a calculation of a target variable are kept.
+
+        :param columns: Iterable of input column names.
+        :param targets: Iterable of variable names, None to perform all possible calculations.
+        :param max_depth: Maximum number of function relations chained in a single calculation, None for no limit.
+        :param max_calculations: Maximum number of calculations the search derives before it stops, None for no limit.
+        :param stats: RunStats to record the search counters in, only if the plan is not cached yet.
+        :return: ExecutionPlan
+        '''
+        if targets is not None:
+            targets = frozenset(targets)
+        plan_key = (frozenset(columns), targets, max_depth, max_calculations)
+        try:
+            plan = self.plans[plan_key]
+        except KeyError:
+            relevant_outputs = None if targets is None else self._chain_backward(targets)
+            search_stats = RunStats(callback=None if stats is None else stats.callback)
+            calculation_graph = self._search(columns,relevant_outputs=relevant_outputs,max_depth=max_depth,max_calculations=max_calculations,stats=search_stats)
+            if targets is not None:
+                calculation_graph = self._prune(calculation_graph,targets)
+            # The callback only receives the live events of the search, the plan keeps the counters
+            search_stats.callback = None
+            if stats is not None:
+                stats.merge(search_stats)
+            plan = ExecutionPlan(columns, calculation_graph, search_stats=search_stats)
+            self.plans[plan_key] = plan
+        return(plan)
+    def _execute_collapsed(self,df,targets=None,max_depth=None,max_calculations=None,stats=None):
+        r'''
+        Performs the calculations of the FunctionSystem on df while searching, such that a calculation of which the
+        result is bitwise identical to an earlier result of the same variable is collapsed into it: it shares the storage
+        of the earlier result and is not used as input for further calculations. Identical results of different
+        variables only share storage. This cuts the combinatorial fan-out of routes which
+        only reproduce known results. As the plan depends on the data, it is not cached.
 
-                # Find calculated columns we can use with the function relation
-                # candidate_columns = [ col for (col,fr_list,col_df) in calculations if func_rel not in fr_list ]
-                # candidate_input = [ (col,fr_list,col_df) for (col,fr_list,col_df) in calculations if func_rel not in fr_list ]
+        :param df: Pandas.DataFrame with column names matching the variable names used in the FunctionRelations.
+        :param targets: Iterable of variable names, see compile.
+        :param max_depth: Maximum number of function relations chained in a single calculation, see compile.
+        :param max_calculations: Maximum number of calculations the search derives, see compile.
+        :param stats: RunStats to collect the search counters and the numeric wall time per function relation in.
+        :return: List of Calculations ordered by node id.
+        '''
+        deduplicator = ResultDeduplicator()
+        cast = (lambda series: series) if self.dtype is None else (lambda series: series.astype(self.dtype,copy=False))
+        input_values = { col:deduplicator.share(cast(df[col])) for col in df.columns }
+        values = {}
+        def get_values(node):
+            if node.function_relation is None:
+                return(input_values[node.col_name])
+            return(values[node])
+        def accept(node):
+            start = time.perf_counter()
+            input_df = pd.concat([ get_values(input_node) for input_node in node.input_nodes ],axis=1)
+            output = cast(node.function_relation.compute_variable(input_df,node.col_name))
+            if stats is not None:
+                stats.record_step(node,time.perf_counter()-start)
+            (values[node], duplicate) = deduplicator.collapse(output)
+            return(not duplicate)
+
+        if targets is not None:
+            targets = frozenset(targets)
+        relevant_outputs = None if targets is None else self._chain_backward(targets)
+        calculation_graph = self._search(df.columns,relevant_outputs=relevant_outputs,max_depth=max_depth,max_calculations=max_calculations,stats=stats,accept=accept)
+        if targets is not None:
+            # Map the computed values onto the re-interned nodes of the pruned graph
+            pruned_graph = self._prune(calculation_graph,targets)
+            pruned_nodes = {}
+            for node in calculation_graph:
+                if all( input_node in pruned_nodes for input_node in node.input_nodes ):
+                    pruned_node = pruned_graph.get((node.col_name, node.function_relation, frozenset( pruned_nodes[input_node] for input_node in node.input_nodes )))
+                    if pruned_node is not None:
+                        pruned_nodes[node] = pruned_node
+            values = { pruned_nodes[node]:node_values for (node, node_values) in values.items() if node in pruned_nodes }
+            calculation_graph = pruned_graph
+
+        calculations = []
+        for node in calculation_graph:
+            history = frozenset( calculations[input_node.node_id] for input_node in node.input_nodes )
+            calculations.append(Calculation(node.col_name, get_values(node), function_relation=node.function_relation, history=history, node=node))
+        return(calculations)
+    def _chain_backward(self,targets):
+        r'''
+        Determines per function relation which output variables can contribute to the targets, by chaining backward from
+        the targets through the function relations.
+
+        :param targets: Iterable of variable names.
+        :return: Dict of function relation to set of output variable names.
+        '''
+        output_index = {}
+        for func_rel in self.function_relations:
+            for output_variable in func_rel.get_output_variables():
+                output_index.setdefault(output_variable,[]).append(func_rel)
+        relevant_outputs = {}
+        needed_variables = set(targets)
+        worklist = list(targets)
+        while worklist:
+            variable = worklist.pop()
+            for func_rel in output_index.get(variable,()):
+                relevant_outputs.setdefault(func_rel,set()).add(variable)
+                for input_variable in func_rel.get_input_variables(variable):
+                    if input_variable not in needed_variables:
+                        needed_variables.add(input_variable)
+                        worklist.append(input_variable)
+        return(relevant_outputs)
+    def _prune(self,calculation_graph,targets):
+        r'''
+        Keeps the input columns, the calculations of target variables and the calculations used by those.
+
+        :param calculation_graph: CalculationGraph resulting from _search.
+        :param targets: Set of variable names.
+        :return: CalculationGraph with the kept nodes, re-interned in the same order.
+        '''
+        kept_nodes = set()
+        for node in reversed(calculation_graph.nodes):
+            if node.function_relation is None or node.col_name in targets or node in kept_nodes:
+                kept_nodes.add(node)
+                kept_nodes.update(node.input_nodes)
+        pruned_graph = CalculationGraph(calculation_graph.relation_bits)
+        pruned_nodes = {}
+        for node in calculation_graph:
+            if node in kept_nodes:
+                input_nodes = ( pruned_nodes[input_node] for input_node in node.input_nodes )
+                pruned_nodes[node] = pruned_graph.intern(node.col_name, node.function_relation, input_nodes)
+        return(pruned_graph)
+    def fuse(self,columns,targets=None,max_depth=None,max_calculations=None):
+        r'''
+        Compiles the FunctionSystem into a FusedPlan for the given input columns, i.e. a single generated numpy function
+        computing every calculation with common subexpressions eliminated. This requires all function relations used
+        by the plan to be SymbolicFunctionRelations. Fused plans are cached per compiled plan.
+
+        :param columns: Iterable of input column names.
+        :param targets: Iterable of variable names, see compile.
+        :param max_depth: Maximum number of function relations chained in a single calculation, see compile.
+        :param max_calculations: Maximum number of calculations the search derives, see compile.
+        :return: FusedPlan
+        '''
+        plan = self.compile(columns,targets=targets,max_depth=max_depth,max_calculations=max_calculations)
+        try:
+            fused_plan = self.fused_plans[plan]
+        except KeyError:
+            fused_plan = FusedPlan(plan)
+            self.fused_plans[plan] = fused_plan
+        return(fused_plan)
+    def evaluate(self,records,targets=None,max_depth=None,max_calculations=None):
+        r'''
+        Low-latency evaluation of a single record, or of a small batch of records, without pandas overhead. The plan is
+        compiled once per set of variables of the records, see compile, and evaluated on plain floats or 1-D arrays.
+
+        :param records: Dict of variable name to scalar, or list of such dicts which all have the same variables.
+        :param targets: Iterable of variable names, see compile.
+        :param max_depth: Maximum number of function relations chained in a single calculation, see compile.
+        :param max_calculations: Maximum number of calculations the search derives, see compile.
+        :return: Dict of label to result, labelled as in ExecutionPlan.get_labels, or a list of such dicts for a list of records.
+        '''
+        plan_options = dict(targets=targets,max_depth=max_depth,max_calculations=max_calculations)
+        if isinstance(records,dict):
+            plan = self.compile(records.keys(),**plan_options)
+            results = plan.evaluate_record(records)
+            return({ label:np.asarray(value).item() for (label, value) in results.items() })
+
+        records = list(records)
+        if not records:
+            return([])
+        variables = frozenset(records[0])
+        for (position, record) in enumerate(records):
+            if frozenset(record) != variables:
+                msg = f'All records of a batch must have the same variables, record {position} is missing {sorted(variables - frozenset(record))} and has extra {sorted(frozenset(record) - variables)}'
+                raise ValueError(msg)
+        plan = self.compile(variables,**plan_options)
+        batch = { col:np.array([ record[col] for record in records ],dtype=self.get_array_dtype()) for col in plan.columns }
+        results = plan.evaluate_record(batch)
+        labels = list(results)
+        rows = np.column_stack([ np.broadcast_to(results[label],(len(records),)) for label in labels ]).tolist()
+        return([ dict(zip(labels, row)) for row in rows ])
+    def run_parallel(self,df,n_workers=None,targets=None,max_depth=None,max_calculations=None):
+        r'''
+        Performs the calculations of the FunctionSystem on df with row shards in parallel worker processes. The plan is
+        compiled once, the input columns are placed in shared memory and every worker writes the results of its rows
+        into a shared output array, such that no data is pickled per shard.
+
+        Function relations are inherited by the workers where the fork start method is available, else they must be
+        picklable.
+
+        :param df: Pandas.DataFrame with column names matching the variable names used in the FunctionRelations.
+        :param n_workers: Number of worker processes, defaults to the number of CPUs.
+        :param targets: Iterable of variable names, see compile.
+        :param max_depth: Maximum number of function relations chained in a single calculation, see compile.
+        :param max_calculations: Maximum number of calculations the search derives, see compile.
+        :return: ColumnStore
+        '''
+        plan = self.compile(df.columns,targets=targets,max_depth=max_depth,max_calculations=max_calculations)
+        return(plan.execute_sharded(df,n_workers=n_workers,dtype=self.get_array_dtype()))
+    def session(self,df,targets=None,max_depth=None,max_calculations=None,executor=None,max_workers=None):
+        r'''
+        Evaluates the FunctionSystem on df and keeps the results in a Session, which recomputes only what changed when
+        rows are appended or an input column is replaced.
+
+        :param df: Pandas.DataFrame with column names matching the variable names used in the FunctionRelations.
+        :param targets: Iterable of variable names, see compile.
+        :param max_depth: Maximum number of function relations chained in a single calculation, see compile.
+        :param max_calculations: Maximum number of calculations the search derives, see compile.
+        :param executor: None, 'threads' or 'processes', see __call__.
+        :param max_workers: Maximum number of workers of the executor.
+        :return: Session
+        '''
+        plan = self.compile(df.columns,targets=targets,max_depth=max_depth,max_calculations=max_calculations)
+        return(Session(plan,df,dtype=self.get_array_dtype(),executor=executor,max_workers=max_workers))
+    def reconcile(self,df,by_route=False,targets=None,max_depth=None,max_calculations=None,executor=None,max_workers=None):
+        r'''
+        Evaluates the FunctionSystem on df with the numpy backend and compares all estimates of every variable, see
+        Reconciliation.reconcile.
+
+        :param df: Pandas.DataFrame with column names matching the variable names used in the FunctionRelations.
+        :param by_route: If True, return a row per estimate instead of a row per variable.
+        :param targets: Iterable of variable names, see compile.
+        :param max_depth: Maximum number of function relations chained in a single calculation, see compile.
+        :param max_calculations: Maximum number of calculations the search derives, see compile.
+        :param executor: None, 'threads' or 'processes', see __call__.
+        :param max_workers: Maximum number of workers of the executor.
+        :return: pandas.DataFrame
+        '''
+        store = self(df,backend='numpy',targets=targets,max_depth=max_depth,max_calculations=max_calculations,executor=executor,max_workers=max_workers)
+        return(reconcile(store,by_route=by_route))
+    def _search(self,columns,relevant_outputs=None,max_depth=None,max_calculations=None,stats=None,accept=None):
+        r'''
+        Performs the symbolic search for all possible calculations starting from the input columns. The search is
+        semi-naive: every pass only considers the function relations using a variable of the calculations found in the
+        previous pass, and only input combinations containing at least one of those calculations.
+
+        :param columns: Iterable of input column names.
+        :param relevant_outputs: Dict of function relation to the output variables to search for, None to search for all.
+        :param max_depth: Maximum number of function relations chained in a single calculation, None for no limit.
+        :param max_calculations: Maximum number of derived calculations, the search stops once it is reached.
+        :param stats: RunStats to record the candidate counts per function relation and the new calculations per pass in.
+        :param accept: Optional data-dependent hook called with every new derived node, returning False to keep the node without using it as input for further calculations.
+        :return: CalculationGraph containing the input columns followed by all derived calculations in topological order.
+        '''
+        if relevant_outputs is None:
+            function_relations = self.function_relations
+        else:
+            function_relations = [ func_rel for func_rel in self.function_relations if func_rel in relevant_outputs ]
+
+        # Intern the symbolic identity of every calculation, this also serves as constant time duplicate check
+        relation_bits = self._get_relation_bits()
+        calculation_graph = CalculationGraph(relation_bits)
+        relation_index = self._index_function_relations(function_relations)
+        relation_order = { func_rel:position for (position,func_rel) in enumerate(self.function_relations) }
+
+        # Calculations of previous passes per variable, and the worklist of calculations of the last pass
+        calculations = {}
+        new_calculations = [ calculation_graph.intern(col) for col in columns ]
+        calculation_limit = None if max_calculations is None else len(new_calculations)+max_calculations
+        if calculation_limit is not None and len(calculation_graph) >= calculation_limit:
+            return(calculation_graph)
+        while new_calculations:
+            new_calculations_per_variable = {}
+            for calc in new_calculations:
+                new_calculations_per_variable.setdefault(calc.col_name,[]).append(calc)
+
+            # Only function relations using a variable of a new calculation can produce new calculations
+            touched_function_relations = set()
+            for variable in new_calculations_per_variable:
+                touched_function_relations.update(relation_index.get(variable,()))
+            touched_function_relations = sorted(touched_function_relations, key=relation_order.get)
+
+            new_calculations = []
+            for func_rel in touched_function_relations:
+                relation_bit = relation_bits[func_rel]
+                output_variables = None if relevant_outputs is None else relevant_outputs[func_rel]
+                relation_stats = None if stats is None else stats.get_relation_stats(func_rel)
+
+                # Find old and new calculated columns we can use with the function relation
+                usable = lambda calc: not (calc.relation_mask & relation_bit) and (max_depth is None or calc.depth < max_depth)
                 candidate_input = [
-                    calc for calc in calculations
-                    if (func_rel not in calc.historic_function_relations)
-                       and (calc.col_name in func_rel.get_all_variables())
+                    calc for variable in func_rel.get_all_variables() for calc in calculations.get(variable,()) if usable(calc)
+                ]
+                new_candidate_input = [
+                    calc for variable in func_rel.get_all_variables() for calc in new_calculations_per_variable.get(variable,()) if usable(calc)
                 ]
-                candidate_columns = [ calc.col_name for calc in candidate_input ]
+                candidate_columns = [ calc.col_name for calc in candidate_input+new_candidate_input ]
 
                 # Check if the function_relation can use the columns to compute any output
-                if func_rel.calculable(candidate_columns):
-
-                    # Loop over all valid input combinations
-                    for (output_variable, input_combination) in self._possible_input_sets(func_rel,candidate_input):
-                        input_combination = list(input_combination)
-
-                        # Check if proposed calculation is desirable
-                        hypothetical_history = frozenset( calc.symbolic_representation() for calc in input_combination )
-                        hypothetical_calculation = HypotheticalCalculation(output_variable, function_relation=func_rel, symbolic_history=hypothetical_history)
-
-                        if not self._compare_hypothetical_calculation(hypothetical_calculation,calculations):
-                            input_df = pd.concat([ calc.col_df for calc in input_combination ],axis=1)
-                            output = func_rel(input_df)
-                            new_calc = Calculation(output_variable, output, function_relation=func_rel, history=frozenset(input_combination))
-                            calculations.append(new_calc)
-                            performed_new_calculations = True
-        return(calculations)
-    def _possible_input_sets(self,func_rel,options):
+                if new_candidate_input and func_rel.calculable(candidate_columns):
+
+                    # Loop over all valid input combinations containing at least one new calculation
+                    for (output_variable, input_combination) in self._possible_input_sets(func_rel,candidate_input,new_candidate_input,output_variables,relation_stats):
+
+                        # Check if proposed calculation is desirable, the key is checked directly against the graph
+                        hypothetical_history = frozenset(input_combination)
+                        if (output_variable, func_rel, hypothetical_history) not in calculation_graph:
+                            new_calc = calculation_graph.intern(output_variable, func_rel, hypothetical_history)
+                            if accept is None or accept(new_calc):
+                                new_calculations.append(new_calc)
+                            if relation_stats is not None:
+                                relation_stats.calculations += 1
+
+                            # Stop cleanly once the budget is reached, all interned calculations are complete
+                            if calculation_limit is not None and len(calculation_graph) >= calculation_limit:
+                                if stats is not None:
+                                    stats.record_pass(len(new_calculations))
+                                return(calculation_graph)
+                        elif relation_stats is not None:
+                            relation_stats.rejected_duplicate += 1
+
+            if stats is not None:
+                stats.record_pass(len(new_calculations))
+
+            # The calculations of this pass become old calculations for the next pass
+            for (variable, variable_calculations) in new_calculations_per_variable.items():
+                calculations.setdefault(variable,[]).extend(variable_calculations)
+        return(calculation_graph)
+    def _get_relation_bits(self):
+        r'''
+        Assigns every function relation in the FunctionSystem its own integer bit, based on its position.
+
+        :return: Dict of function relation to integer bit.
+        '''
+        relation_bits = { func_rel:1<<position for (position,func_rel) in enumerate(self.function_relations) }
+        return(relation_bits)
+    def _index_function_relations(self,function_relations=None):
+        r'''
+        Builds an inverted index from variable name to the function relations using the variable.
+
+        :param function_relations: Iterable of function relations to index, defaults to all function relations.
+        :return: Dict of variable name to list of function relations.
+        '''
+        if function_relations is None:
+            function_relations = self.function_relations
+        relation_index = {}
+        for func_rel in function_relations:
+            for variable in func_rel.get_all_variables():
+                relation_index.setdefault(variable,[]).append(func_rel)
+        return(relation_index)
+    def _possible_input_sets(self,func_rel,options,new_options=None,output_variables=None,relation_stats=None):
         r'''
         Subroutine to generate all possible input relations based on the optional input variables and a given function relation.
 
+        If new_options is given, only combinations containing at least one of new_options are generated. Each of these
+        is generated exactly once by taking the first new calculation at dimension i, old calculations before i and any
+        calculation after i.
+
         :param func_rel:  FunctionRelation
-        :param options: List-like of input variable names.
+        :param options: List-like of CalculationNodes.
+        :param new_options: List-like of CalculationNodes, disjoint from options.
+        :param output_variables: Iterable of output variables to consider, defaults to all output variables of func_rel.
+        :param relation_stats: RelationStats to count the generated candidates and relation set rejections in.
         :return: Generator of possible calculation to perform, does not consider calculation history.
         '''
+        if output_variables is None:
+            output_variables = func_rel.get_output_variables()
+
         # Per output_variable yield potential input combinations
-        for output_variable in func_rel.get_output_variables():
+        for output_variable in output_variables:
 
             # Gather all input_variables
-            input_variables = func_rel.get_input_variables(output_variable)
+            input_variables = list(func_rel.get_input_variables(output_variable))
 
             # Construct input_variable options per dimension
-            input_combinations = [ [ calc for calc in options if input_variable == calc.col_name ] for input_variable in input_variables ]
-
-            # Per input_combination yield output_variable with input_combination
-            for input_combination in product(*input_combinations):
-
-                # Only yield if input_combination is a valid pairing of input dimensions
-                if self._compare_function_relation_sets([calc.historic_function_relations for calc in input_combination ]):
+            old_combinations = [ [ calc for calc in options if input_variable == calc.col_name ] for input_variable in input_variables ]
+            if new_options is None:
+                combination_sets = [old_combinations]
+            else:
+                new_combinations = [ [ calc for calc in new_options if input_variable == calc.col_name ] for input_variable in input_variables ]
+                all_combinations = [ old+new for (old,new) in zip(old_combinations,new_combinations) ]
+                combination_sets = [
+                    old_combinations[:i] + [new_combinations[i]] + all_combinations[i+1:]
+                    for i in range(len(input_variables)) if new_combinations[i]
+                ]
 
-                    # Yield output_variable with input_combination
+            # Per valid input_combination yield output_variable with input_combination
+            for input_combinations in combination_sets:
+                for input_combination in self._disjoint_combinations(input_combinations,relation_stats=relation_stats):
+                    if relation_stats is not None:
+                        relation_stats.candidates += 1
                     yield(output_variable,input_combination)
-    def _compare_hypothetical_calculation(self,hypothetical_calculation,calculations):
-        r'''
-        Determines if a hypothetical calculation has already been performed in the historical calculations.
-
-        :param hypothetical_calculation:
-        :param calculations:
-        :return:
-        '''
-        compare_list = [ hypothetical_calculation.symbolic_representation() == calc.symbolic_representation() for calc in calculations ]
-        return(any(compare_list))
-    def _compare_function_relation_sets(self,fr_lists):
+    def _disjoint_combinations(self,input_combinations,relation_mask=0,relation_stats=None):
         r'''
-        Determines if a List-like of FunctionRelations contains no duplicates, and hence if it is a valid combination function relation set.
+        Generates the cartesian product of input_combinations restricted to valid pairings of input dimensions, i.e.
+        combinations in which no function relation is consumed twice. Partial combinations are pruned as soon as they
+        become invalid, by comparing the relation mask of each option to the union mask of the options chosen so far.
 
-        :param fr_lists: List-like of FunctionRelations
-        :return:
+        :param input_combinations: List-like of List-likes of CalculationNodes, one per input dimension.
+        :param relation_mask: Integer union of the relation masks of the options chosen so far.
+        :param relation_stats: RelationStats to count the rejected partial combinations in.
+        :return: Generator of tuples of CalculationNodes.
         '''
-        all_function_relations = reduce(lambda x,y: x|y, [ fr_list for fr_list in fr_lists], frozenset())
-        for fr in all_function_relations:
-            if len([ None for fr_list in fr_lists if fr in fr_list ]) > 1:
-                return(False)
-        return(True)
+        if not input_combinations:
+            yield(())
+            return
+        for calc in input_combinations[0]:
+            if not (calc.relation_mask & relation_mask):
+                for input_combination in self._disjoint_combinations(input_combinations[1:], relation_mask | calc.relation_mask, relation_stats):
+                    yield((calc,)+input_combination)
+            elif relation_stats is not None:
+                relation_stats.rejected_relation_set += 1
 
 class SymbolicFunctionSystem(FunctionSystem):
-    def __init__(self,function_relations,variables,constants=None):
+    def __init__(self,function_relations,variables,constants=None,cache=None,n_jobs=None,dtype=None):
         r'''
         User-friendly helper class to create a FunctionSystem with a symbolic list of function relations in string format. Sympy is used to complete the inversions. Symbolic function relations must follow python syntax. Variables and constants must match case.
 
         :param function_relations: List-like of string formatted function relations, e.g. 'a * b = c'.
         :param variables: List-like of formatted variables used in function relations.
         :param constants: Dict-like of constants in contant_name:contant_value format.
+        :param cache: InversionCache or path of a cache directory to store the sympy inversions in, None to not cache.
+        :param n_jobs: Number of worker processes to solve the inversions with, None to solve them in this process.
+        :param dtype: numpy dtype policy of the system, see FunctionSystem.
         '''
         if constants is None:
             constants = dict()
+        if cache is not None and not isinstance(cache,InversionCache):
+            cache = InversionCache(cache)
         self.symbolic_function_relations = function_relations
         self.variables = variables
         self.constants = constants
+        self.cache = cache
+        self.n_jobs = n_jobs
         self.transform_symbolic_function_relations()
-        super(SymbolicFunctionSystem,self).__init__(self.function_relations)
+        super(SymbolicFunctionSystem,self).__init__(self.function_relations,dtype=dtype)
     def __str__(self):
         r'''
         Outputs the string formatted collection of the function relations.
@@ -148,11 +607,67 @@ class SymbolicFunctionSystem(FunctionSystem):
 
         :return:
         '''
+        variables = frozenset(self.variables)
+        sfr_variables = [ self._get_formula_variables(sfr,variables) for sfr in self.symbolic_function_relations ]
+        if self.n_jobs is None:
+            solutions = [None]*len(self.symbolic_function_relations)
+        else:
+            solutions = self._solve_inversions_in_parallel(sfr_variables)
         function_relations = []
-        for sfr in self.symbolic_function_relations:
-            variable_in_formula = lambda v,sfr=sfr: re.search(r'\b{v}\b'.format(v=v),sfr) is not None
-            sfr_variables = frozenset( v for v in self.variables if variable_in_formula(v))
-            fr = SymbolicFunctionRelation(sfr,sfr_variables,constants=self.constants)
+        for (sfr, variables, sfr_solutions) in zip(self.symbolic_function_relations, sfr_variables, solutions):
+            fr = SymbolicFunctionRelation(sfr,variables,constants=self.constants,cache=self.cache,solutions=sfr_solutions)
             function_relations.append(fr)
         self.function_relations = function_relations
+    def _get_formula_variables(self,sfr,variables=None):
+        r'''
+        Determines the variables used in a string formatted function relation, by extracting its identifiers once and
+        looking them up in the set of variables.
+
+        :param sfr: Str formatted function relation.
+        :param variables: Frozenset of the variables of the system, defaults to the variables given during the init.
+        :return:
+        '''
+        if variables is None:
+            variables = frozenset(self.variables)
+        sfr_variables = frozenset(get_identifiers(sfr) & variables)
+        return(sfr_variables)
+    def _solve_inversions_in_parallel(self,sfr_variables):
+        r'''
+        Solves the inversions of all symbolic function relations in a process pool, with one job per (relation, variable)
+        pair. Relations of which the inversions are in the cache are not solved again.
+
+        :param sfr_variables: List of variable sets, aligned with the symbolic function relations.
+        :return: List of dicts of variable name to solved sympy expression or None, aligned with the symbolic function relations.
+        '''
+        formulas = []
+        solutions = []
+        unsolved = []
+        for (sfr, variables) in zip(self.symbolic_function_relations, sfr_variables):
+            sympy_variables = { v:sympy.symbols(v) for v in variables }
+            formula = formula_to_sympy(sfr,sympy_variables,self.constants)
+            cached_solutions = None
+            if self.cache is not None:
+                cached_solutions = self.cache.get(self.cache.get_key(formula,variables,self.constants))
+            if cached_solutions is None:
+                unsolved.append(len(solutions))
+                cached_solutions = {}
+            formulas.append(formula)
+            solutions.append(cached_solutions)
+        if not unsolved:
+            return(solutions)
+
+        with ProcessPoolExecutor(max_workers=self.n_jobs) as pool:
+            jobs = {
+                (position, variable):pool.submit(solve_inversion_srepr,sympy.srepr(formulas[position]),variable)
+                for position in unsolved for variable in sfr_variables[position]
+            }
+            for ((position, variable), job) in jobs.items():
+                solution_srepr = job.result()
+                solutions[position][variable] = None if solution_srepr is None else sympy.sympify(solution_srepr)
 
+        # Store the newly solved inversions, the relations receive their solutions and do not store them themselves
+        if self.cache is not None:
+            for position in unsolved:
+                cache_key = self.cache.get_key(formulas[position],sfr_variables[position],self.constants)
+                self.cache.set(cache_key,solutions[position])
+        return(solutions)
@@ -0,0 +1,54 @@
+import numpy as np
+import sympy
+
+from ColumnStores import ColumnStore
+from FunctionRelations import SymbolicFunctionRelation
+
+
+class FusedPlan:
+    def __init__(self,plan):
+        r'''
+        FusedPlan generates one numpy function which performs all steps of an ExecutionPlan in a single pass. The solved
+        expression of every step is composed with the expressions of its inputs, and common subexpressions are
+        eliminated across all outputs with sympy.cse. This requires every step to use a SymbolicFunctionRelation.
+
+        :param plan: ExecutionPlan to fuse.
+        '''
+        self.plan = plan
+        self.leaf_ids = plan.get_leaf_ids()
+        self.leaf_symbols = [ sympy.Symbol(col) for col in plan.columns ]
+        self.expressions = self.compose_expressions()
+        self.function = sympy.lambdify(self.leaf_symbols, [ self.expressions[step.node_id] for step in plan.steps ], modules='numpy', cse=True)
+    def compose_expressions(self):
+        r'''
+        Expresses the result of every node of the plan in terms of the input columns.
+
+        :return: Dict of node id to sympy expression.
+        '''
+        expressions = dict(zip(self.leaf_ids, self.leaf_symbols))
+        for step in self.plan.steps:
+            func_rel = step.function_relation
+            if not isinstance(func_rel,SymbolicFunctionRelation):
+                msg = f'Only plans of SymbolicFunctionRelations can be fused, got {func_rel}'
+                raise TypeError(msg)
+            substitutions = {
+                func_rel.sympy_variables[input_variable]:expressions[input_id]
+                for (input_variable, input_id) in zip(step.input_variables, step.input_ids)
+            }
+            expressions[step.node_id] = func_rel.solutions[step.col_name].xreplace(substitutions)
+        return(expressions)
+    def __call__(self,df,dtype=np.float64):
+        r'''
+        Performs all calculations of the plan on the input dataframe df with the fused function.
+
+        :param df: Pandas.DataFrame containing the columns the plan was compiled for.
+        :param dtype: numpy dtype of the stored results.
+        :return: ColumnStore
+        '''
+        store = ColumnStore(self.plan,df.index,dtype=dtype)
+        for (col, leaf_id) in zip(self.plan.columns, self.leaf_ids):
+            store.write(leaf_id, df[col].to_numpy())
+        outputs = self.function(*( store.column(leaf_id) for leaf_id in self.leaf_ids ))
+        for (step, output) in zip(self.plan.steps, outputs):
+            store.write(step.node_id, output)
+        return(store)
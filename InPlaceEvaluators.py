@@ -0,0 +1,188 @@
+import threading
+
+import numpy as np
+import sympy
+
+
+class BufferPool:
+    def __init__(self):
+        r'''
+        BufferPool keeps released numpy arrays per shape and dtype, such that temporaries of in-place evaluations are
+        reused instead of allocated for every step. Only the buffers of the most recently requested shape and dtype are
+        kept: requesting another shape releases all pooled buffers, such that a pool used for batches of varying size
+        does not pin a set of buffers per size. The pool is thread-safe.
+        '''
+        self.buffers = {}
+        self.lock = threading.Lock()
+    def __len__(self):
+        return(sum( len(buffers) for buffers in self.buffers.values() ))
+    def __getstate__(self):
+        # Pooled buffers are scratch memory, a pool is pickled empty
+        return({})
+    def __setstate__(self,state):
+        self.__init__()
+    def get(self,shape,dtype):
+        r'''
+        Returns an uninitialized array, reusing a released one if available.
+
+        :param shape: Tuple of the shape of the array.
+        :param dtype: numpy dtype of the array.
+        :return: numpy.ndarray
+        '''
+        key = (tuple(shape), np.dtype(dtype))
+        with self.lock:
+            if key not in self.buffers:
+                self.buffers.clear()
+                self.buffers[key] = []
+            buffers = self.buffers[key]
+            if buffers:
+                return(buffers.pop())
+        return(np.empty(shape,dtype=dtype))
+    def release(self,buffer):
+        r'''
+        Returns an array obtained with get to the pool.
+
+        :param buffer: numpy.ndarray
+        :return:
+        '''
+        key = (buffer.shape, buffer.dtype)
+        with self.lock:
+            # Buffers of a shape which is no longer requested are dropped
+            if key in self.buffers:
+                self.buffers[key].append(buffer)
+    def clear(self):
+        with self.lock:
+            self.buffers.clear()
+
+
+# numpy ufuncs of the sympy functions supported by InPlaceEvaluator
+_UFUNCS = {
+    sympy.sin: np.sin,
+    sympy.cos: np.cos,
+    sympy.tan: np.tan,
+    sympy.asin: np.arcsin,
+    sympy.acos: np.arccos,
+    sympy.atan: np.arctan,
+    sympy.sinh: np.sinh,
+    sympy.cosh: np.cosh,
+    sympy.tanh: np.tanh,
+    sympy.exp: np.exp,
+    sympy.log: np.log,
+    sympy.Abs: np.absolute,
+}
+
+class InPlaceEvaluator:
+    def __init__(self,expression):
+        r'''
+        InPlaceEvaluator evaluates a sympy expression with numpy ufuncs writing into a preallocated out array. The
+        result of every sum, product, power and function is accumulated in place, hence temporaries are only needed for
+        operands which are compound expressions themselves, and these are taken from a BufferPool.
+
+        :param expression: sympy expression of Add, Mul, Pow, numbers, symbols and the functions in _UFUNCS.
+        :raises NotImplementedError: If the expression contains other operations.
+        '''
+        self.expression = expression
+        self.evaluate = self._compile(expression)
+    def __call__(self,columns,out,pool=None):
+        r'''
+        Evaluates the expression into out.
+
+        :param columns: Mapping of variable names to numpy arrays, e.g. a ColumnView.
+        :param out: numpy.ndarray receiving the result, its dtype is kept for all intermediate results.
+        :param pool: BufferPool to take temporaries from, None to allocate them.
+        :return: out
+        '''
+        if pool is None:
+            pool = BufferPool()
+        self.evaluate(columns,out,pool)
+        return(out)
+    def _compile(self,expression):
+        r'''
+        Compiles expression into a function f(columns, out, pool) which writes the value of the expression into out.
+
+        :param expression: sympy expression.
+        :return:
+        '''
+        if expression.is_Symbol:
+            name = expression.name
+            return(lambda columns,out,pool: np.copyto(out,columns[name],casting='unsafe'))
+        if expression.is_number:
+            try:
+                value = float(expression)
+            except TypeError as te:
+                msg = f'Only real numbers can be evaluated in place, got {expression}'
+                raise NotImplementedError(msg) from te
+            return(lambda columns,out,pool: out.fill(value))
+        if expression.is_Add or expression.is_Mul:
+            ufunc = np.add if expression.is_Add else np.multiply
+            return(self._compile_reduction(ufunc,expression.args))
+        if expression.is_Pow:
+            return(self._compile_power(*expression.args))
+        if expression.func in _UFUNCS and len(expression.args) == 1:
+            ufunc = _UFUNCS[expression.func]
+            evaluate_argument = self._compile(expression.args[0])
+            def evaluate(columns,out,pool):
+                evaluate_argument(columns,out,pool)
+                ufunc(out,out=out)
+            return(evaluate)
+        msg = f'{expression.func} can not be evaluated in place.'
+        raise NotImplementedError(msg)
+    def _compile_operand(self,expression):
+        r'''
+        Compiles an operand of a binary ufunc into a function f(columns, out, pool) returning a tuple of the operand and
+        the temporary holding it, or None if no temporary is used.
+
+        :param expression: sympy expression.
+        :return:
+        '''
+        if expression.is_Symbol:
+            name = expression.name
+            return(lambda columns,out,pool: (columns[name], None))
+        if expression.is_number and expression.is_real:
+            value = float(expression)
+            return(lambda columns,out,pool: (value, None))
+        evaluate_operand = self._compile(expression)
+        def operand(columns,out,pool):
+            temporary = pool.get(out.shape,out.dtype)
+            evaluate_operand(columns,temporary,pool)
+            return((temporary, temporary))
+        return(operand)
+    def _compile_reduction(self,ufunc,args):
+        # Compound operands first, such that out is written by the first and the others are accumulated
+        args = sorted(args,key=lambda arg: arg.is_Symbol or arg.is_number)
+        evaluate_first = self._compile(args[0])
+        operands = [ self._compile_operand(arg) for arg in args[1:] ]
+        def evaluate(columns,out,pool):
+            evaluate_first(columns,out,pool)
+            for operand in operands:
+                (value, temporary) = operand(columns,out,pool)
+                ufunc(out,value,out=out)
+                if temporary is not None:
+                    pool.release(temporary)
+        return(evaluate)
+    def _compile_power(self,base,exponent):
+        evaluate_base = self._compile(base)
+        if exponent.is_number and exponent.is_real:
+            exponent = float(exponent)
+            if exponent == -1:
+                apply = lambda out: np.reciprocal(out,out=out)
+            elif exponent == 2:
+                apply = lambda out: np.square(out,out=out)
+            elif exponent == 0.5:
+                apply = lambda out: np.sqrt(out,out=out)
+            elif exponent == -0.5:
+                apply = lambda out: np.reciprocal(np.sqrt(out,out=out),out=out)
+            else:
+                apply = lambda out: np.power(out,exponent,out=out)
+            def evaluate(columns,out,pool):
+                evaluate_base(columns,out,pool)
+                apply(out)
+            return(evaluate)
+        operand = self._compile_operand(exponent)
+        def evaluate(columns,out,pool):
+            evaluate_base(columns,out,pool)
+            (value, temporary) = operand(columns,out,pool)
+            np.power(out,value,out=out)
+            if temporary is not None:
+                pool.release(temporary)
+        return(evaluate)
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import sympy
+
+
+class InversionCache:
+    def __init__(self,directory):
+        r'''
+        InversionCache stores the sympy inversions of symbolic function relations on disk, such that constructing the
+        same SymbolicFunctionRelation again skips sympy.solve. Solutions are stored as srepr strings in one json file
+        per formula. Entries are stored per sympy version, hence upgrading sympy invalidates the cache.
+
+        :param directory: Path of the cache directory, created if it does not exist.
+        '''
+        self.directory = os.path.join(directory,f'sympy-{sympy.__version__}')
+    def get_key(self,formula,variables,constants):
+        r'''
+        Computes the cache key of a formula.
+
+        :param formula: sympy expression of the function relation with the constants substituted.
+        :param variables: Iterable of variable names.
+        :param constants: Dict-like of (constant_name,constant_value) pairs.
+        :return: Str hex digest.
+        '''
+        key_parts = [
+            sympy.srepr(formula),
+            sorted(variables),
+            sorted( (str(constant_name), repr(constant_value)) for (constant_name, constant_value) in constants.items() ),
+        ]
+        key = hashlib.sha256(json.dumps(key_parts).encode('utf-8')).hexdigest()
+        return(key)
+    def _get_path(self,key):
+        return(os.path.join(self.directory,f'{key}.json'))
+    def get(self,key):
+        r'''
+        Loads the solutions stored under key.
+
+        :param key: Str cache key, see get_key.
+        :return: Dict of variable name to sympy expression or None, or None if the key is not in the cache.
+        '''
+        try:
+            with open(self._get_path(key),'r') as cache_file:
+                stored_solutions = json.load(cache_file)
+        except (OSError, ValueError):
+            return(None)
+        solutions = {
+            variable_name:( None if solution is None else sympy.sympify(solution) )
+            for (variable_name, solution) in stored_solutions.items()
+        }
+        return(solutions)
+    def set(self,key,solutions):
+        r'''
+        Stores solutions under key. The file is written atomically, such that concurrent processes never read a
+        partially written entry.
+
+        :param key: Str cache key, see get_key.
+        :param solutions: Dict of variable name to sympy expression or None.
+        :return:
+        '''
+        stored_solutions = {
+            variable_name:( None if solution is None else sympy.srepr(solution) )
+            for (variable_name, solution) in solutions.items()
+        }
+        os.makedirs(self.directory,exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory,suffix='.tmp')
+        with os.fdopen(file_descriptor,'w') as cache_file:
+            json.dump(stored_solutions,cache_file)
+        os.replace(temporary_path,self._get_path(key))
@@ -0,0 +1,115 @@
+class RelationStats:
+    __slots__ = ('calls', 'numeric_time', 'candidates', 'rejected_relation_set', 'rejected_duplicate', 'calculations')
+
+    def __init__(self):
+        r'''
+        RelationStats holds the counters of a single function relation, see RunStats.
+        '''
+        self.calls = 0
+        self.numeric_time = 0.0
+        self.candidates = 0
+        self.rejected_relation_set = 0
+        self.rejected_duplicate = 0
+        self.calculations = 0
+    def merge(self,other):
+        for field in self.__slots__:
+            setattr(self,field,getattr(self,field)+getattr(other,field))
+    def to_dict(self):
+        return({ field:getattr(self,field) for field in self.__slots__ })
+
+
+class RunStats:
+    def __init__(self,callback=None):
+        r'''
+        RunStats collects instrumentation of FunctionSystem runs. Per function relation it counts the candidate input
+        combinations generated by the search, the partial combinations rejected because they consume a function relation
+        twice, the candidates rejected as duplicates and the accepted calculations, and it measures the calls and wall
+        time of the numeric function. Per pass of the search it counts the new calculations.
+
+        The search only runs when a plan is compiled, hence its counters are only recorded by the run which compiled the
+        plan. They are also kept with the plan as ExecutionPlan.search_stats. Runs of a cached plan only record the
+        numeric work of that run.
+
+        :param callback: Optional function called as callback(event, info) with event 'pass' and info dict with keys
+        pass_number and new_calculations, or event 'step' and info dict with keys function_relation, col_name and elapsed.
+        '''
+        self.callback = callback
+        self.relations = {}
+        self.passes = []
+    def get_relation_stats(self,func_rel):
+        r'''
+        Returns the counters of func_rel, creating them if they do not exist yet.
+
+        :param func_rel: PartialFunctionRelation
+        :return: RelationStats
+        '''
+        try:
+            relation_stats = self.relations[func_rel]
+        except KeyError:
+            relation_stats = RelationStats()
+            self.relations[func_rel] = relation_stats
+        return(relation_stats)
+    def record_pass(self,new_calculations):
+        r'''
+        Records the number of new calculations of a pass of the search.
+
+        :param new_calculations: Integer number of calculations added in the pass.
+        :return:
+        '''
+        self.passes.append(new_calculations)
+        if self.callback is not None:
+            self.callback('pass',{'pass_number':len(self.passes),'new_calculations':new_calculations})
+    def record_step(self,step,elapsed):
+        r'''
+        Records the wall time of the numeric function of a plan step.
+
+        :param step: PlanStep, or CalculationNode if the step is evaluated during the search.
+        :param elapsed: Float seconds.
+        :return:
+        '''
+        relation_stats = self.get_relation_stats(step.function_relation)
+        relation_stats.calls += 1
+        relation_stats.numeric_time += elapsed
+        if self.callback is not None:
+            self.callback('step',{'function_relation':step.function_relation,'col_name':step.col_name,'elapsed':elapsed})
+    def merge(self,other):
+        r'''
+        Adds the counters of other to these counters. The events of other are not replayed to the callback.
+
+        :param other: RunStats
+        :return:
+        '''
+        for (func_rel, relation_stats) in other.relations.items():
+            self.get_relation_stats(func_rel).merge(relation_stats)
+        self.passes.extend(other.passes)
+    def to_dict(self):
+        r'''
+        Exports the counters as a dict, with the function relations keyed by their string representation.
+
+        :return:
+        '''
+        out = {
+            'relations':{ str(func_rel):relation_stats.to_dict() for (func_rel, relation_stats) in self.relations.items() },
+            'passes':list(self.passes),
+        }
+        return(out)
+    def report(self,sort='numeric_time'):
+        r'''
+        Formats the counters as a table in the style of pstats, one row per function relation.
+
+        :param sort: Name of the counter to sort the rows by, descending.
+        :return: Str
+        '''
+        columns = ['calls', 'numeric_time', 'candidates', 'rejected_relation_set', 'rejected_duplicate', 'calculations']
+        lines = [
+            f'{len(self.passes)} passes, new calculations per pass: {self.passes}',
+            '',
+            ' '.join(f'{column:>21}' for column in columns) + '  function_relation',
+        ]
+        rows = sorted(self.relations.items(), key=lambda item: getattr(item[1],sort), reverse=True)
+        for (func_rel, relation_stats) in rows:
+            values = [ f'{relation_stats.numeric_time:>21.6f}' if column == 'numeric_time' else f'{getattr(relation_stats,column):>21d}' for column in columns ]
+            lines.append(' '.join(values) + f'  {func_rel}')
+        return('\n'.join(lines))
+    def print_report(self,sort='numeric_time'):
+        print(self.report(sort=sort))
@@ -0,0 +1,94 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from ColumnStores import ColumnStore
+
+
+def group_estimates(results):
+    r'''
+    Groups the results of a FunctionSystem by variable name, stacking all estimates of a variable into one 2-D array.
+
+    :param results: ColumnStore, or list of Calculations as returned by the pandas backend.
+    :return: Dict of variable name to tuple of (labels, measured position or None, 2-D numpy array with a column per estimate).
+    '''
+    if isinstance(results,ColumnStore):
+        nodes = results.plan.get_nodes()
+        labels = results.plan.get_labels()
+        get_columns = lambda positions: results.data[:,positions]
+    else:
+        nodes = [ calc.node for calc in results ]
+        labels = [ node.col_name if node.function_relation is None else f'{node.col_name}[{node.node_id}]' for node in nodes ]
+        get_columns = lambda positions: np.column_stack([ np.asarray(results[position].col_df,dtype=np.float64) for position in positions ])
+
+    positions = {}
+    for (position, node) in enumerate(nodes):
+        positions.setdefault(node.col_name,[]).append(position)
+
+    groups = {}
+    for (variable, variable_positions) in positions.items():
+        measured = next(( i for (i, position) in enumerate(variable_positions) if nodes[position].function_relation is None ), None)
+        groups[variable] = ([ labels[position] for position in variable_positions ], measured, get_columns(variable_positions))
+    return(groups)
+
+def reconcile(results,by_route=False):
+    r'''
+    Compares all estimates of the same variable, i.e. the measured column and every calculated route, with vectorized
+    reductions over one stacked array per variable. No pairwise frames are created.
+
+    Per variable the summary contains the number of estimates, whether it was measured, the mean and maximum spread
+    (largest minus smallest estimate per row), the maximum absolute residual of any route against the measurement and
+    the route attaining it. With by_route, it instead contains a row per estimate with the mean, root mean square and
+    maximum absolute deviation from the measurement. Residuals of unmeasured variables are NaN. NaN values in the
+    estimates are ignored.
+
+    :param results: ColumnStore, or list of Calculations as returned by the pandas backend.
+    :param by_route: If True, return a row per estimate indexed by variable and route label instead of a row per variable.
+    :return: pandas.DataFrame
+    '''
+    rows = []
+    with warnings.catch_warnings():
+        # All-NaN rows or routes are reported as NaN
+        warnings.simplefilter('ignore',category=RuntimeWarning)
+        for (variable, (labels, measured, estimates)) in group_estimates(results).items():
+            spread = np.nanmax(estimates,axis=1) - np.nanmin(estimates,axis=1)
+            if measured is None:
+                residuals = np.full(estimates.shape,np.nan)
+            else:
+                residuals = estimates - estimates[:,[measured]]
+            abs_deviation = np.nanmax(np.abs(residuals),axis=0)
+
+            if by_route:
+                mean_deviation = np.nanmean(residuals,axis=0)
+                rms_deviation = np.sqrt(np.nanmean(residuals**2,axis=0))
+                for (i, label) in enumerate(labels):
+                    rows.append({
+                        'variable': variable,
+                        'route': label,
+                        'measured': i == measured,
+                        'mean_deviation': mean_deviation[i],
+                        'rms_deviation': rms_deviation[i],
+                        'max_abs_deviation': abs_deviation[i],
+                    })
+            else:
+                if measured is None or len(labels) == 1:
+                    (max_residual, worst_route) = (np.nan, None)
+                else:
+                    worst = np.argmax(np.where(np.isnan(abs_deviation),-np.inf,abs_deviation))
+                    (max_residual, worst_route) = (abs_deviation[worst], labels[worst])
+                rows.append({
+                    'variable': variable,
+                    'n_estimates': len(labels),
+                    'measured': measured is not None,
+                    'mean_spread': np.nanmean(spread),
+                    'max_spread': np.nanmax(spread),
+                    'max_residual': max_residual,
+                    'worst_route': worst_route,
+                })
+
+    if by_route:
+        summary = pd.DataFrame(rows,columns=['variable','route','measured','mean_deviation','rms_deviation','max_abs_deviation']).set_index(['variable','route'])
+    else:
+        summary = pd.DataFrame(rows,columns=['variable','n_estimates','measured','mean_spread','max_spread','max_residual','worst_route']).set_index('variable')
+    return(summary)
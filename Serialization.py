@@ -0,0 +1,58 @@
+import pickle
+
+
+def _import_cloudpickle():
+    try:
+        import cloudpickle
+    except ImportError as ie:
+        msg = 'Serializing function relations holding lambdas or local functions requires cloudpickle.'
+        raise ImportError(msg) from ie
+    return(cloudpickle)
+
+def dumps(obj):
+    r'''
+    Serializes a function relation, FunctionSystem or ExecutionPlan to bytes.
+
+    SymbolicFunctionRelations store their solved expressions, such that loading rebuilds their functions without
+    calling sympy.solve. Compiled plans are stored with the FunctionSystem, such that loading skips the search. The
+    functions of other function relations are pickled by reference if they are defined at module level, lambdas and
+    local functions are pickled by value with cloudpickle.
+
+    :param obj: Object to serialize.
+    :return: Bytes.
+    '''
+    try:
+        return(pickle.dumps(obj,protocol=pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, AttributeError, TypeError):
+        cloudpickle = _import_cloudpickle()
+        return(cloudpickle.dumps(obj,protocol=pickle.HIGHEST_PROTOCOL))
+
+def loads(data):
+    r'''
+    Deserializes an object serialized with dumps. Only load data from trusted sources, as unpickling can execute code.
+
+    :param data: Bytes.
+    :return:
+    '''
+    return(pickle.loads(data))
+
+def save(obj,path):
+    r'''
+    Serializes obj with dumps and writes it to a file.
+
+    :param obj: Object to serialize.
+    :param path: Path of the file.
+    :return:
+    '''
+    with open(path,'wb') as serialized_file:
+        serialized_file.write(dumps(obj))
+
+def load(path):
+    r'''
+    Reads an object saved with save. Only load files from trusted sources, as unpickling can execute code.
+
+    :param path: Path of the file.
+    :return:
+    '''
+    with open(path,'rb') as serialized_file:
+        return(loads(serialized_file.read()))
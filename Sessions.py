@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class Session:
+    def __init__(self,plan,df,dtype=np.float64,executor=None,max_workers=None):
+        r'''
+        Session holds an ExecutionPlan together with the results of a dataframe, such that updates of the data only
+        recompute what changed. Appended rows are computed for every calculation and appended to the existing results,
+        a replaced input column only recomputes the calculations whose history includes that column.
+
+        The results are kept in a ColumnStore, see ExecutionPlan.execute_columnar. Views obtained from the store before
+        an update may be stale afterwards, hence results should be read from the session again after every update.
+
+        :param plan: ExecutionPlan of the FunctionSystem, see FunctionSystem.compile.
+        :param df: Pandas.DataFrame containing the columns the plan was compiled for.
+        :param dtype: numpy dtype of the stored results.
+        :param executor: None, 'threads' or 'processes', see ExecutionPlan.execute_columnar.
+        :param max_workers: Maximum number of workers of the executor.
+        '''
+        self.plan = plan
+        self.dtype = dtype
+        self.executor = executor
+        self.max_workers = max_workers
+        self.store = plan.execute_columnar(df,dtype=dtype,executor=executor,max_workers=max_workers)
+    def __len__(self):
+        return(len(self.store.index))
+    def append(self,df):
+        r'''
+        Computes all calculations for the rows of df and appends them to the results.
+
+        :param df: Pandas.DataFrame with the same columns as the session.
+        :return: ColumnStore holding the results of the appended rows only.
+        '''
+        if frozenset(df.columns) != frozenset(self.plan.columns):
+            msg = f'Appended rows must have the same columns, expected {sorted(self.plan.columns)} but got {sorted(df.columns)}'
+            raise ValueError(msg)
+        new_store = self.plan.execute_columnar(df,dtype=self.dtype,executor=self.executor,max_workers=self.max_workers)
+        self.store.append(new_store)
+        return(new_store)
+    def replace(self,col,values):
+        r'''
+        Replaces the values of an input column and recomputes the calculations whose history includes it.
+
+        :param col: Name of an input column of the session.
+        :param values: Array-like with a value per row of the session.
+        :return: List of node ids of the recomputed calculations.
+        '''
+        if col not in self.plan.columns:
+            msg = f'Only input columns can be replaced, {col} is not one of {sorted(self.plan.columns)}'
+            raise ValueError(msg)
+        values = np.asarray(values)
+        if values.shape != (len(self),):
+            msg = f'Expected {len(self)} values for column {col}, got an array of shape {values.shape}'
+            raise ValueError(msg)
+        leaf_id = self.plan.get_leaf_ids()[self.plan.columns.index(col)]
+        self.store.write(leaf_id, values)
+        dependent_steps = self.plan.get_dependent_steps([leaf_id])
+        self.plan.compute_columnar(self.store,steps=dependent_steps,executor=self.executor,max_workers=self.max_workers)
+        return([ step.node_id for step in dependent_steps ])
+    def to_frame(self):
+        r'''
+        Exposes the current results as a pandas DataFrame, see ColumnStore.to_frame.
+
+        :return: pandas.DataFrame
+        '''
+        return(self.store.to_frame())
@@ -0,0 +1,78 @@
+import os
+
+import pandas as pd
+
+
+def _is_path(source):
+    return(isinstance(source,(str,os.PathLike)))
+
+def _is_parquet(path):
+    return(str(path).lower().endswith(('.parquet','.pq')))
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as ie:
+        msg = 'Reading and writing parquet files in chunks requires pyarrow.'
+        raise ImportError(msg) from ie
+    return(pyarrow)
+
+def iterate_chunks(source,chunksize=100_000):
+    r'''
+    Iterates over a source of data in DataFrame chunks.
+
+    :param source: Iterable of pandas DataFrames, or a path to a CSV or parquet file which is read in chunks.
+    :param chunksize: Number of rows per chunk when reading from a path.
+    :return: Generator of pandas DataFrames.
+    '''
+    if not _is_path(source):
+        yield from source
+    elif _is_parquet(source):
+        pyarrow = _import_pyarrow()
+        parquet_file = pyarrow.parquet.ParquetFile(source)
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            yield(batch.to_pandas())
+    else:
+        with pd.read_csv(source,chunksize=chunksize) as reader:
+            yield from reader
+
+
+class ChunkWriter:
+    def __init__(self,path):
+        r'''
+        ChunkWriter appends DataFrame chunks to a CSV or parquet file, such that only one chunk is held in memory. The
+        index of the chunks is not written.
+
+        :param path: Path of the output file, written as parquet if it ends with .parquet or .pq, else as CSV.
+        '''
+        self.path = path
+        self.parquet_writer = None
+        self.csv_started = False
+        self.rows_written = 0
+    def __enter__(self):
+        return(self)
+    def __exit__(self,*exc_info):
+        self.close()
+    def write(self,df):
+        r'''
+        Appends the chunk df to the output file.
+
+        :param df: pandas DataFrame, all chunks must share the same columns.
+        :return:
+        '''
+        if _is_parquet(self.path):
+            pyarrow = _import_pyarrow()
+            table = pyarrow.Table.from_pandas(df,preserve_index=False)
+            if self.parquet_writer is None:
+                self.parquet_writer = pyarrow.parquet.ParquetWriter(self.path,table.schema)
+            self.parquet_writer.write_table(table)
+        else:
+            first_chunk = not self.csv_started
+            df.to_csv(self.path,mode='w' if first_chunk else 'a',header=first_chunk,index=False)
+            self.csv_started = True
+        self.rows_written += len(df)
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
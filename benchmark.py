@@ -0,0 +1,177 @@
+import argparse
+import json
+import platform
+import timeit
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from FunctionRelations import FunctionRelation
+from FunctionSystem import FunctionSystem, SymbolicFunctionSystem
+
+#%% SYNTHETIC SYSTEM GENERATORS
+
+def additive_relation(variables):
+    r'''
+    Creates a FunctionRelation stating that the last variable is the sum of the others, with all inversions.
+
+    :param variables: List of variable names.
+    :return: FunctionRelation
+    '''
+    total, parts = variables[-1], variables[:-1]
+    function_dict = { total:lambda df,parts=parts: sum(df[part] for part in parts) }
+    for part in parts:
+        others = [ other for other in parts if other != part ]
+        function_dict[part] = lambda df,total=total,others=others: df[total] - sum(df[other] for other in others)
+    return(FunctionRelation(function_dict))
+
+def chain_variables(n_relations,variables_per_relation):
+    r'''
+    Variable sets of a chain, consecutive relations share one variable.
+    '''
+    step = variables_per_relation-1
+    return([ [ f'x{i*step+j}' for j in range(variables_per_relation) ] for i in range(n_relations) ])
+
+def star_variables(n_relations,variables_per_relation):
+    r'''
+    Variable sets of a star, all relations share the hub variable x0.
+    '''
+    step = variables_per_relation-1
+    return([ ['x0'] + [ f'x{i*step+j+1}' for j in range(step) ] for i in range(n_relations) ])
+
+def mesh_variables(n_relations,variables_per_relation,seed=0):
+    r'''
+    Variable sets of a dense mesh, every relation uses a random subset of a small pool of variables.
+    '''
+    rng = np.random.default_rng(seed)
+    pool = [ f'x{i}' for i in range(max(variables_per_relation,n_relations+1)) ]
+    return([ list(rng.choice(pool,size=variables_per_relation,replace=False)) for _ in range(n_relations) ])
+
+TOPOLOGIES = {
+    'chain': chain_variables,
+    'star': star_variables,
+    'mesh': mesh_variables,
+}
+
+def generate_function_system(topology,n_relations,variables_per_relation):
+    relations = [ additive_relation(variables) for variables in TOPOLOGIES[topology](n_relations,variables_per_relation) ]
+    return(FunctionSystem(relations))
+
+def generate_symbolic_function_system(topology,n_relations,variables_per_relation):
+    variable_sets = TOPOLOGIES[topology](n_relations,variables_per_relation)
+    formulas = [ f'{variables[-1]}=' + '*'.join(variables[:-1]) for variables in variable_sets ]
+    variables = sorted(set( variable for variable_set in variable_sets for variable in variable_set ))
+    return(SymbolicFunctionSystem(formulas,variables))
+
+def generate_data(function_system,n_rows,observed_fraction=0.5,seed=0):
+    r'''
+    Creates random positive data for a random subset of the variables of the function system.
+    '''
+    rng = np.random.default_rng(seed)
+    variables = sorted(set( variable for func_rel in function_system.function_relations for variable in func_rel.get_all_variables() ))
+    n_observed = max(1,int(round(observed_fraction*len(variables))))
+    observed = sorted(rng.choice(variables,size=n_observed,replace=False))
+    df = pd.DataFrame(rng.random(size=(n_rows,n_observed))+0.5,columns=observed)
+    return(df)
+
+#%% MEASUREMENT
+
+def measure(function_system,df,max_calculations=None,repeats=5):
+    r'''
+    Measures the symbolic search and the numeric evaluation of a function system separately. Every time is the minimum
+    of repeats runs, such that single-run noise does not show up as regression. Peak memory is measured in a separate
+    run, as tracing allocations slows down the timed runs.
+
+    :return: Dict of measurements.
+    '''
+    search_time = min(timeit.repeat(
+        lambda: function_system.compile(df.columns,max_calculations=max_calculations),
+        setup=function_system.plans.clear,number=1,repeat=repeats,
+    ))
+    plan = function_system.compile(df.columns,max_calculations=max_calculations)
+    numeric_time = min(timeit.repeat(
+        lambda: function_system(df,max_calculations=max_calculations),
+        number=1,repeat=repeats,
+    ))
+
+    function_system.plans.clear()
+    tracemalloc.start()
+    function_system(df,max_calculations=max_calculations)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {
+        'search_time': search_time,
+        'numeric_time': numeric_time,
+        'calculations': len(plan),
+        'peak_memory': peak_memory,
+    }
+    return(result)
+
+def run(kinds,topologies,relation_counts,variables_per_relation,row_counts,max_calculations=None,repeats=5):
+    results = {}
+    for kind in kinds:
+        generate = generate_function_system if kind == 'function' else generate_symbolic_function_system
+        for topology in topologies:
+            for n_relations in relation_counts:
+                for n_variables in variables_per_relation:
+                    function_system = generate(topology,n_relations,n_variables)
+                    for n_rows in row_counts:
+                        df = generate_data(function_system,n_rows)
+                        name = f'{kind}/{topology}/relations={n_relations}/variables={n_variables}/rows={n_rows}'
+                        results[name] = measure(function_system,df,max_calculations=max_calculations,repeats=repeats)
+                        print(format_result(name,results[name]))
+    return(results)
+
+def format_result(name,result,baseline=None):
+    line = f"{name:<55} search {result['search_time']*1e3:9.2f} ms  numeric {result['numeric_time']*1e3:9.2f} ms  calculations {result['calculations']:6d}  peak {result['peak_memory']/2**20:8.2f} MiB"
+    if baseline is not None:
+        total = result['search_time'] + result['numeric_time']
+        baseline_total = baseline['search_time'] + baseline['numeric_time']
+        line += f'  x{total/baseline_total:5.2f} vs baseline'
+    return(line)
+
+def compare(results,baseline,tolerance):
+    r'''
+    Prints the results relative to a baseline and returns the names of the cases which regressed by more than tolerance.
+    '''
+    regressions = []
+    for (name, result) in results.items():
+        if name not in baseline:
+            continue
+        print(format_result(name,result,baseline[name]))
+        total = result['search_time'] + result['numeric_time']
+        baseline_total = baseline[name]['search_time'] + baseline[name]['numeric_time']
+        if total > (1+tolerance)*baseline_total or result['calculations'] != baseline[name]['calculations']:
+            regressions.append(name)
+    return(regressions)
+
+#%% COMMAND LINE
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the search and evaluation scaling of FunctionSystems.')
+    parser.add_argument('--kinds',nargs='+',default=['function','symbolic'],choices=['function','symbolic'])
+    parser.add_argument('--topologies',nargs='+',default=list(TOPOLOGIES),choices=list(TOPOLOGIES))
+    parser.add_argument('--relations',nargs='+',type=int,default=[2,4,6,10])
+    parser.add_argument('--variables',nargs='+',type=int,default=[3])
+    parser.add_argument('--rows',nargs='+',type=int,default=[1_000,100_000])
+    parser.add_argument('--max-calculations',type=int,default=None,help='Search budget per system, see FunctionSystem.compile.')
+    parser.add_argument('--repeats',type=int,default=5,help='Number of timed runs per case, the minimum is reported.')
+    parser.add_argument('--save',default=None,help='Path to save the results as json baseline.')
+    parser.add_argument('--compare',default=None,help='Path of a json baseline to compare the results against.')
+    parser.add_argument('--tolerance',type=float,default=0.25,help='Relative slowdown reported as regression.')
+    args = parser.parse_args()
+
+    results = run(args.kinds,args.topologies,args.relations,args.variables,args.rows,max_calculations=args.max_calculations,repeats=args.repeats)
+    if args.save is not None:
+        with open(args.save,'w') as baseline_file:
+            json.dump({'platform':platform.platform(),'python':platform.python_version(),'repeats':args.repeats,'results':results},baseline_file,indent=1)
+    if args.compare is not None:
+        with open(args.compare,'r') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(results,baseline,args.tolerance)
+        if regressions:
+            print('Regressions:')
+            for name in regressions:
+                print(f'  {name}')
+            raise SystemExit(1)
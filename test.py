@@ -190,3 +190,329 @@ print((test_c == aaa).all())
 
 
 
+
+#%% SYMBOLIC FUNCTION RELATION TEST - FORMULA PARSING
+
+df = pd.DataFrame(data=np.random.random(size=(10,3)),columns=['c','d','e'])
+sfr = SymbolicFunctionRelation('e=c+d',['c','d','e'])
+try:
+    SymbolicFunctionRelation('a=b=c',['a','b','c'])
+    rejects_chained = False
+except ValueError:
+    rejects_chained = True
+result = \
+np.allclose(sfr(df[['c','d']]),df['c']+df['d']) &\
+np.allclose(sfr(df[['d','e']]),df['e']-df['d']) &\
+rejects_chained
+print(result)
+
+#%% FUNCTION SYSTEM TEST - COMPILED PLAN REUSE
+
+df = pd.DataFrame(data=np.random.random(size=(10,4)),columns=['a','b','c','d'])
+fs = FunctionSystem([pfr1,pfr2])
+plan = fs.compile(df.columns)
+out = fs(df)
+result = \
+(fs.compile(['d','c','b','a']) is plan) &\
+(len(out) == len(plan)) &\
+all( (calc.col_df == plan_calc.col_df).all() for calc,plan_calc in zip(out,plan.execute(df)) )
+print(result)
+
+#%% FUNCTION SYSTEM TEST - NUMPY BACKEND
+
+store = fs(df,backend='numpy')
+out_df = store.to_frame()
+result = \
+(out_df.shape == (len(df),len(out))) &\
+all( np.allclose(calc.col_df.to_numpy(),out_df[label].to_numpy()) for calc,label in zip(fs(df),fs.compile(df.columns).get_labels()) )
+print(result)
+
+#%% FUNCTION SYSTEM TEST - THREADED EXECUTION
+
+result = all( (calc.col_df == parallel_calc.col_df).all() for calc,parallel_calc in zip(fs(df),fs(df,executor='threads',max_workers=2)) )
+print(result)
+
+#%% SYMBOLIC FUNCTION SYSTEM TEST - FUSED PLAN
+
+df = pd.DataFrame(data=np.random.random(size=(10,3)),columns=['b','c','d'])
+result = np.allclose(sfs(df,backend='numpy').to_frame().to_numpy(),sfs(df,backend='fused').to_frame().to_numpy())
+for unsupported_options in (dict(backend='fused',executor='threads'), dict(backend='fused',max_workers=2), dict(cache_size=3)):
+    try:
+        sfs(df,**unsupported_options)
+        result = False
+    except ValueError:
+        pass
+print(result)
+
+#%% FUNCTION SYSTEM TEST - TARGETED CALCULATION
+
+df = pd.DataFrame(data=np.random.random(size=(10,3)),columns=['a','b','c'])
+fs = FunctionSystem([pfr1,pfr2])
+out = fs(df,targets=['d'])
+out_all = fs(df)
+result = \
+(sum( calc.col_name == 'd' for calc in out ) == sum( calc.col_name == 'd' for calc in out_all )) &\
+(len(out) < len(out_all)) &\
+all( calc.node.depth <= 1 for calc in fs(df,targets=['d'],max_depth=1) ) &\
+(len(fs(df,max_calculations=0)) == len(df.columns)) &\
+(len(fs(df,max_calculations=1)) == len(df.columns)+1)
+print(result)
+
+#%% FUNCTION SYSTEM TEST - LAZY CALCULATIONS
+
+df = pd.DataFrame(data=np.random.random(size=(10,4)),columns=['a','b','c','d'])
+out = fs(df)
+lazy_out = fs(df,lazy=True,cache_size=3)
+result = \
+(not any( calc.is_computed() for calc in lazy_out[4:] )) &\
+all( (calc.col_df == lazy_calc.col_df).all() for calc,lazy_calc in zip(out,lazy_out) ) &\
+(len(lazy_out[4].result_cache) == 3)
+print(result)
+
+#%% FUNCTION SYSTEM TEST - PROFILING
+
+from Profiling import RunStats
+
+fs.plans.clear()
+events = []
+stats = RunStats(callback=lambda event,info: events.append(event))
+out = fs(df,stats=stats)
+out = fs(df,stats=stats)
+try:
+    fs(df,lazy=True,stats=stats)
+    rejects_lazy = False
+except ValueError:
+    rejects_lazy = True
+result = \
+(sum( relation_stats.calculations for relation_stats in stats.relations.values() ) == len(out) - len(df.columns)) &\
+(sum( relation_stats.calls for relation_stats in stats.relations.values() ) == 2*(len(out) - len(df.columns))) &\
+(sum(stats.passes) == len(out) - len(df.columns)) &\
+(events.count('pass') == len(stats.passes)) &\
+(events.index('pass') < events.index('step')) &\
+rejects_lazy
+print(result)
+
+#%% FUNCTION SYSTEM TEST - INCREMENTAL SESSION
+
+df = pd.DataFrame(data=np.random.random(size=(20,3)),columns=['a','b','c'])
+session = fs.session(df.iloc[:10])
+session.append(df.iloc[10:15])
+session.append(df.iloc[15:])
+recomputed = session.replace('b',df['b']*2)
+df_replaced = df.assign(b=df['b']*2)
+result = \
+np.allclose(session.to_frame().to_numpy(),fs(df_replaced,backend='numpy').to_frame().to_numpy()) &\
+(len(recomputed) < len(session.plan.steps))
+print(result)
+
+#%% FUNCTION SYSTEM TEST - RECONCILIATION
+
+from Reconciliation import reconcile
+
+df = pd.DataFrame(data=np.random.random(size=(10,4)),columns=['a','b','c','d'])
+summary = fs.reconcile(df)
+routes = reconcile(fs(df),by_route=True)
+result = \
+(summary.loc['a','n_estimates'] == sum( calc.col_name == 'a' for calc in fs(df) )) &\
+np.isclose(summary.loc['a','max_residual'],routes.loc['a','max_abs_deviation'].max()) &\
+(routes.loc[('a','a'),'max_abs_deviation'] == 0)
+print(result)
+
+#%% FUNCTION SYSTEM TEST - MEMORY-MAPPED RESULTS
+
+import tempfile
+from ColumnStores import open_results
+
+df = pd.DataFrame(data=np.random.random(size=(10,3)),columns=['a','b','c'])
+with tempfile.TemporaryDirectory() as directory:
+    store = fs(df,backend='numpy',directory=directory)
+    reopened = open_results(directory)
+    result = \
+    isinstance(store.column(0),np.memmap) &\
+    (reopened.to_numpy() == fs(df,backend='numpy').to_frame().to_numpy()).all() &\
+    (list(reopened.columns) == store.plan.get_labels())
+    del store, reopened
+labelled_df = df.set_index(pd.Index([ f'row{i}' for i in range(len(df)) ]))
+with tempfile.TemporaryDirectory() as directory:
+    store = fs(labelled_df,backend='numpy',directory=directory)
+    reopened = open_results(directory)
+    try:
+        store.append(store)
+        rejects_append = False
+    except TypeError:
+        rejects_append = True
+    result &= (list(reopened.index) == list(labelled_df.index)) & rejects_append
+    del store, reopened
+try:
+    fs(df.set_index(pd.Index([ (i,) for i in range(len(df)) ],tupleize_cols=False)),backend='numpy',directory=directory)
+    result = False
+except TypeError:
+    pass
+print(result)
+
+#%% FUNCTION SYSTEM TEST - ROW-SHARDED PARALLEL EXECUTION
+
+df = pd.DataFrame(data=np.random.random(size=(101,3)),columns=['a','b','c'])
+result = np.allclose(fs.run_parallel(df,n_workers=3).to_frame().to_numpy(),fs(df,backend='numpy').to_frame().to_numpy())
+print(result)
+
+#%% SYMBOLIC FUNCTION SYSTEM TEST - SERIALIZATION
+
+from Serialization import dumps, loads
+
+df = pd.DataFrame(data=np.random.random(size=(10,3)),columns=['b','c','d'])
+loaded_sfs = loads(dumps(sfs))
+result = \
+(len(loaded_sfs.plans) == len(sfs.plans)) &\
+np.allclose(loaded_sfs(df,backend='numpy').to_frame().to_numpy(),sfs(df,backend='numpy').to_frame().to_numpy())
+print(result)
+
+#%% SYMBOLIC FUNCTION SYSTEM TEST - RECORD EVALUATION
+
+import asyncio
+from Batching import MicroBatcher
+
+records = [ {'b':b,'c':c,'d':d} for (b,c,d) in np.random.random(size=(5,3)) ]
+frame = sfs(pd.DataFrame(records),backend='numpy').to_frame()
+async def evaluate_records(records):
+    batcher = MicroBatcher(sfs)
+    return(await asyncio.gather(*( batcher.evaluate(record) for record in records )))
+result = \
+all( np.allclose(list(sfs.evaluate(record).values()),frame.iloc[i].to_numpy()) for (i, record) in enumerate(records) ) &\
+(asyncio.run(evaluate_records(records)) == sfs.evaluate(records))
+for mismatched_records in ([records[0], dict(records[1],e=1.0)], [records[0], {'b':1.0,'c':1.0}]):
+    try:
+        sfs.evaluate(mismatched_records)
+        result = False
+    except ValueError:
+        pass
+print(result)
+
+#%% SYMBOLIC FUNCTION SYSTEM TEST - FLOAT32 POLICY AND IN-PLACE EVALUATION
+
+from InPlaceEvaluators import BufferPool
+
+df = pd.DataFrame(data=np.random.random(size=(10,3)),columns=['b','c','d'])
+sfs.dtype = np.float32
+float32_fs = FunctionSystem([FunctionRelation({'a':lambda df: df['b']+np.arange(len(df)),'b':lambda df: df['a']-np.arange(len(df))})],dtype=np.float32)
+store = sfs(df,backend='numpy')
+inplace_store = sfs(df,backend='numpy',inplace=True)
+result = \
+(store.data.dtype == np.float32) &\
+all( calc.col_df.dtype == np.float32 for calc in sfs(df) ) &\
+all( calc.col_df.dtype == np.float32 for calc in sfs(df,lazy=True) ) &\
+all( calc.col_df.dtype == np.float32 for calc in float32_fs(df[['b']],lazy=True) ) &\
+np.allclose(inplace_store.data,store.data,equal_nan=True)
+buffer_pool = BufferPool()
+for n_rows in range(100,110):
+    buffer_pool.release(buffer_pool.get((n_rows,),np.float32))
+result &= (len(buffer_pool) == 1) & (list(buffer_pool.buffers) == [((109,), np.dtype(np.float32))])
+sfs.dtype = None
+print(result)
+
+#%% FUNCTION SYSTEM TEST - RESULT DEDUPLICATION
+
+function_dict1 = {
+	'a': lambda df: df['b']+df['c'],
+	'b': lambda df: df['a']-df['c'],
+	'c': lambda df: df['a']-df['b'],
+}
+function_dict2 = {
+	'a': lambda df: df['c']+df['b'],
+	'b': lambda df: df['a']-df['c'],
+	'c': lambda df: df['a']-df['b'],
+}
+function_dict3 = {
+	'd': lambda df: 2*df['a'],
+	'a': lambda df: df['d']/2,
+}
+dedup_fs = FunctionSystem([FunctionRelation(function_dict1),FunctionRelation(function_dict2),FunctionRelation(function_dict3)])
+df = pd.DataFrame(data=np.random.random(size=(10,2)),columns=['b','c'])
+plain = dedup_fs(df)
+shared = dedup_fs(df,dedup='share')
+collapsed = dedup_fs(df,dedup='collapse')
+result = \
+all( (calc.col_df == shared_calc.col_df).all() for (calc, shared_calc) in zip(plain, shared) ) &\
+np.shares_memory(shared[2].col_df.to_numpy(),shared[3].col_df.to_numpy()) &\
+(len(collapsed) < len(shared)) &\
+(sorted(set( calc.col_name for calc in collapsed )) == ['a','b','c','d'])
+function_dict4 = {
+	'd': lambda df: df['a']+1,
+	'a': lambda df: df['d']-1,
+}
+product_fs = FunctionSystem([FunctionRelation({'a':lambda df: df['b']*df['c'],'b':lambda df: df['a']/df['c'],'c':lambda df: df['a']/df['b']}),FunctionRelation(function_dict4)])
+df = pd.DataFrame({'b':np.random.random(size=10),'c':np.ones(10)})
+result &= \
+(sorted(set( calc.col_name for calc in product_fs(df,dedup='collapse') )) == ['a','b','c','d']) &\
+any( calc.col_name == 'd' for calc in product_fs(df,dedup='collapse',targets=['d']) )
+print(result)
+
+#%% FUNCTION SYSTEM TEST - STREAMING
+
+import os
+import tempfile
+
+df = pd.DataFrame(data=np.random.random(size=(10,3)),columns=['a','b','c'])
+expected = fs(df,backend='numpy').to_frame()
+streamed = pd.concat(fs.stream([df.iloc[:4],df.iloc[4:]]))
+with tempfile.TemporaryDirectory() as directory:
+    input_path = os.path.join(directory,'input.csv')
+    output_path = os.path.join(directory,'output.csv')
+    df.to_csv(input_path,index=False)
+    rows_written = fs.stream_to_file(input_path,output_path,chunksize=3)
+    written = pd.read_csv(output_path)
+try:
+    list(fs.stream([df,df[['a','b']]]))
+    rejects_columns = False
+except ValueError:
+    rejects_columns = True
+result = \
+np.allclose(streamed.to_numpy(),expected.to_numpy()) &\
+(streamed.index == expected.index).all() &\
+(rows_written == len(df)) &\
+(list(written.columns) == list(expected.columns)) &\
+np.allclose(written.to_numpy(),expected.to_numpy()) &\
+rejects_columns
+print(result)
+
+#%% SYMBOLIC FUNCTION SYSTEM TEST - INVERSION CACHE
+
+import sympy
+import FunctionRelations
+
+def fail_to_solve(formula,variable):
+    raise AssertionError('solve_inversion called despite a filled cache')
+
+with tempfile.TemporaryDirectory() as directory:
+    cached_sfs = SymbolicFunctionSystem(['c=a*b','d=b*c'],['a','b','c','d'],cache=directory)
+    solve_inversion = FunctionRelations.solve_inversion
+    FunctionRelations.solve_inversion = fail_to_solve
+    try:
+        loaded_sfs = SymbolicFunctionSystem(['c=a*b','d=b*c'],['a','b','c','d'],cache=directory)
+    finally:
+        FunctionRelations.solve_inversion = solve_inversion
+    cache_directories = os.listdir(directory)
+result = \
+(cache_directories == [f'sympy-{sympy.__version__}']) &\
+all( fr.solutions == loaded_fr.solutions for (fr, loaded_fr) in zip(cached_sfs.function_relations, loaded_sfs.function_relations) )
+print(result)
+
+#%% SYMBOLIC FUNCTION SYSTEM TEST - PARALLEL INVERSIONS
+
+import FunctionSystem as function_system_module
+
+formulas = ['c=a*b','d=b*c','e=c+d']
+serial_sfs = SymbolicFunctionSystem(formulas,['a','b','c','d','e'])
+with tempfile.TemporaryDirectory() as directory:
+    SymbolicFunctionSystem(formulas[:1],['a','b','c','d','e'],cache=directory)
+    parallel_sfs = SymbolicFunctionSystem(formulas,['a','b','c','d','e'],cache=directory,n_jobs=2)
+    process_pool_executor = function_system_module.ProcessPoolExecutor
+    function_system_module.ProcessPoolExecutor = None
+    try:
+        cached_sfs = SymbolicFunctionSystem(formulas,['a','b','c','d','e'],cache=directory,n_jobs=2)
+    finally:
+        function_system_module.ProcessPoolExecutor = process_pool_executor
+result = \
+all( fr.solutions == parallel_fr.solutions for (fr, parallel_fr) in zip(serial_sfs.function_relations, parallel_sfs.function_relations) ) &\
+all( fr.solutions == cached_fr.solutions for (fr, cached_fr) in zip(serial_sfs.function_relations, cached_sfs.function_relations) )
+print(result)